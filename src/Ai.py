@@ -3,70 +3,321 @@ Computer agent to play metaTicTacToe.
 Computer plays by negamax with alpha-beta pruning.
 Pseudocode from http://chessprogramming.wikispaces.com/Negamax
 
+The search runs on a single Bitboard (see Bitboard.py): each move is made in place
+and unmade on the way back up, so no game state is copied per node.
+Results are cached in a transposition table (see Transposition.py), where
+symmetric positions near the root share an entry (see Symmetry.py).
+Moves are searched best-first (see Ordering.py).
+Opening moves come from a precomputed book (see OpeningBook.py),
+and endgames with few empty cells are solved exactly (see Endgame.py).
+
+Games can choose Monte Carlo Tree Search instead of negamax (see Mcts.py)
+by setting Game.ai_engine.
+
 Created on Oct 30, 2013
 @author: Vivian Brown
 """
 
-import copy
 import logging
-import re
-from Models import User, Game
+import time
+from Bitboard import Bitboard, TWO_IN_A_ROW
+from Transposition import TranspositionTable, EXACT, LOWER, UPPER
+from Ordering import MoveOrderer
+import OpeningBook
+import Endgame
+import Mcts
+import Symmetry
+
+TIME_BUDGET = 0.2 # Seconds the AI may spend searching for a move
+ENGINES = ('negamax', 'mcts') # Values of Game.ai_engine
+WORKERS = 1 # Processes to search with (see Parallel.py). App Engine instances can't start processes.
+ENDGAME_SHARE = 0.5 # Share of the time budget to spend trying to solve an endgame exactly
+SYMMETRY_DEPTH = 3 # Nodes with at least this much depth left are cached under their canonical position.
+                   # Canonicalizing costs more than it saves closer to the leaves.
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the deadline has passed."""
+    pass
+
+class SearchContext():
+    """State shared by every node of a single search."""
+    
+    def __init__(self, depth, table=None, orderer=None, deadline=None, pv=None):
+        self.depth = depth # Depth of the root, to tell how far from the root a node is
+        self.table = table # TranspositionTable, or None
+        self.orderer = orderer # MoveOrderer, or None to search moves in the order they are generated
+        self.deadline = deadline # time.time() at which to give up, or None
+        self.pv = pv or {} # Principal variation of the previous iteration, as {position key: move}
+        self.nodes = 0
+        self.leaves = 0 # Positions evaluated with the heuristic, at depth 0 or the end of the game
+        self.cutoffs = 0 # Nodes where a move caused a beta cutoff
+        self.first_move_cutoffs = 0 # ... and the move was the first one searched
+        self.table_hits = 0 # Transposition table lookups that found an entry
+
+class SearchStats():
+    """
+    The work done to choose a move, for benchmarks and logging.
+    Pass one to nextMove, chooseMove or iterativeDeepening to fill it in.
+    """
+    
+    def __init__(self):
+        self.source = None # What chose the move: 'book', 'endgame', 'mcts', 'parallel' or 'search'
+        self.elapsed = 0.0 # Seconds taken to choose the move
+        self.nodes = 0 # Nodes visited (playouts for MCTS), including in an iteration cut short by the deadline
+        self.leaves = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.table_hits = 0
+        self.depth = 0 # Depth of the last completed iteration
+        self.iterations = [] # (depth, nodes, seconds) for each completed iteration
+    
+    def add(self, search):
+        """Add the counts of a SearchContext."""
+        self.nodes += search.nodes
+        self.leaves += search.leaves
+        self.cutoffs += search.cutoffs
+        self.first_move_cutoffs += search.first_move_cutoffs
+        self.table_hits += search.table_hits
+    
+    def first_move_cutoff_rate(self):
+        """Share of cutoffs caused by the first move searched. Close to 1 means good move ordering."""
+        return float(self.first_move_cutoffs)/self.cutoffs if self.cutoffs else 0.0
+    
+    def branching_factor(self):
+        """Effective branching factor: how many times more nodes the last iteration took than the one before."""
+        if len(self.iterations) < 2 or not self.iterations[-2][1]:
+            return 0.0
+        return float(self.iterations[-1][1])/self.iterations[-2][1]
+    
+    def __str__(self):
+        plies = ' '.join('%d:%d/%.0fms' % (depth, nodes, seconds*1000) for depth, nodes, seconds in self.iterations)
+        return ('%s in %.0fms: depth %d, %d nodes, %d leaves, %d cutoffs (%.0f%% first move), '
+                '%d table hits, branching factor %.1f, per ply [%s]' %
+                (self.source, self.elapsed*1000, self.depth, self.nodes, self.leaves, self.cutoffs,
+                 self.first_move_cutoff_rate()*100, self.table_hits, self.branching_factor(), plies))
  
-def nextMove(game):
+def nextMove(game, time_budget=TIME_BUDGET, workers=WORKERS, stats=None):
     """
     Compute the next move for a player.
-    This is a wrapper function for the recursive function negamax.
+    This is a wrapper function for chooseMove.
     
-    We calculate maximum search depth based on the number of empty cells remaining on the metaboard.
-    Why?
-    1. Search is slow at the beginning because the branching factor is high - so depth should be small (~4).
-    2. Deep search is worth more close to the end of the game - so go deep (up to 9)
+    Arguments: 
+        game: Game object to evaluate. game.ai_engine chooses the search.
+        time_budget: seconds to search for
+        workers: number of processes to split the negamax search between
+        stats: SearchStats to fill in, or None
+        
+    Return:
+        (board_num, cell): the best move
+    """
+    treeId = game.key().id() if game.ai_engine == 'mcts' else None
+    return chooseMove(Bitboard.from_game(game), time_budget, game.ai_engine, treeId, workers, stats)
+
+def chooseMove(state, time_budget=TIME_BUDGET, engine='negamax', tree_id=None, workers=WORKERS, stats=None):
+    """
+    Compute the next move for the player to move in a Bitboard.
+    
+    Positions in the opening book are not searched at all.
+    Positions with few empty cells left are solved exactly, if that can be done in part of the time budget.
+    Otherwise search depth is not fixed: we search one ply deeper at a time until the time budget runs out.
+    Positions early in the game (high branching factor) get a shallow search
+    and positions close to the end of the game get a deep one, in about the same time.
     
     Arguments: 
-        game: Game object to evaluate
+        state: Bitboard to evaluate (not modified)
+        time_budget: seconds to search for
+        engine: one of ENGINES
+        tree_id: id to keep the MCTS tree under between moves (normally the game id), or None
+        workers: number of processes to split the negamax search between
+        stats: SearchStats to fill in, or None
         
     Return:
         (board_num, cell): the best move
     """
-    cells_remaining = sum(map(lambda s: s.count(' '), game.metaboard))
-    max_depth = int(cells_remaining*(-.05) + 7)
+    if stats is None:
+        stats = SearchStats()
+    started = time.time()
+    bestMove = _chooseMove(state, time_budget, engine, tree_id, workers, stats)
+    stats.elapsed = time.time() - started
+    return bestMove
+
+def _chooseMove(state, time_budget, engine, tree_id, workers, stats):
+    """Body of chooseMove. Sets stats.source to the part that chose the move."""
+    bookMove = OpeningBook.lookup(state)
+    if bookMove in state.legal_moves():
+        stats.source = 'book'
+        return bookMove
+    
+    if Endgame.worth_solving(state):
+        started = time.time()
+        solved = Endgame.solve(state, time_budget*ENDGAME_SHARE)
+        if solved is not None:
+            stats.source = 'endgame'
+            return solved[1]
+        time_budget -= time.time() - started
+    
+    if engine == 'mcts':
+        stats.source = 'mcts'
+        bestMove, stats.nodes = Mcts.best_move(state, time_budget, tree_id=tree_id)
+        return bestMove
     
-    util, bestMove, path = negamax(game, max_depth, float('-inf'), float('inf'), [])
+    if workers > 1:
+        import Parallel # Imported here because Parallel imports this module
+        stats.source = 'parallel'
+        util, bestMove, path = Parallel.parallel_search(state, time_budget, workers)
+    else:
+        stats.source = 'search'
+        util, bestMove, path = iterativeDeepening(state, time_budget, stats=stats)
     return bestMove
+
+def iterativeDeepening(state, time_budget, max_depth=None, table=None, orderer=None, on_iteration=None, stats=None):
+    """
+    Search to depth 1, 2, 3... until time_budget seconds have passed.
+    Each iteration searches the principal variation of the previous one first.
+    
+    Arguments:
+        state: Bitboard to evaluate (not modified)
+        time_budget: seconds to search for. Depth 1 is always completed.
+        max_depth: deepest iteration to run, or None to stop only when the board is full
+        table: TranspositionTable to use, or None for a new one
+        orderer: MoveOrderer to use, or None for a new one
+        on_iteration: function called as on_iteration(depth, result) after each completed iteration
+        stats: SearchStats to add the work done to, or None
+        
+    Return Value:
+        (utility, move, path) from the last completed iteration, as returned by negamax.
+    """
+    deadline = time.time() + time_budget
+    state = state.copy() # A search that times out leaves moves on the board
+    if table is None:
+        table = TranspositionTable()
+    if orderer is None:
+        orderer = MoveOrderer()
+    table.new_search()
+    cells_remaining = 81 - bin(state.x | state.o).count('1')
+    if max_depth is None or max_depth > cells_remaining:
+        max_depth = cells_remaining
+    
+    result = (state.utility(), (-1,-1), [])
+    pv = {}
+    for depth in range(1, max_depth + 1):
+        started = time.time()
+        search = SearchContext(depth, table, orderer, deadline if depth > 1 else None, pv)
+        try:
+            result = _negamax(state, depth, float('-inf'), float('inf'), search)
+        except SearchTimeout:
+            break
+        finally:
+            if stats is not None:
+                stats.add(search)
+        if stats is not None:
+            stats.depth = depth
+            stats.iterations.append((depth, search.nodes, time.time() - started))
+        if on_iteration is not None:
+            on_iteration(depth, result)
+        
+        # Remember the principal variation to search it first next time.
+        pv = {}
+        line = []
+        for move, utility in result[2]:
+            if move == (-1,-1):
+                break
+            pv[state.key] = move
+            line.append(state.make(*move))
+        for undo in reversed(line):
+            state.unmake(undo)
+        
+        if abs(result[0]) >= 1000: # The game is decided, searching deeper won't change the move
+            break
+    return result
  
-def negamax(game, depth, alpha, beta, path):
+def negamax(game, depth, alpha, beta, path=None, table=None, orderer=None):
     """
     Compute the next move for a player given the current board state and also
     compute the utility of that move.
  
     Arguments:
-        game: Game object to evaluate
+        game: Game or Bitboard to evaluate. A Game is converted to a Bitboard first;
+              a Bitboard is searched in place and left as it was found.
         depth: Maximum search depth
         alpha: best utility for O along path to root - initialize to negative infinity
         beta: best utility for X along path to root - initialize to positive infinity
+        path: unused, kept for compatibility with older callers
+        table: TranspositionTable to consult and update, or None to search without one
+        orderer: MoveOrderer to sort moves with, or None to search them in cell order
  
     Return Value:
         utility: The goodness of the move for the current player. 
         (nextboard, nextcell): position where the player can play the next move so that the
                          player wins or draws or delays the loss
+        path: the principal variation, as a list of (move, utility)
     """
+    state = game if isinstance(game, Bitboard) else Bitboard.from_game(game)
+    if table is not None:
+        table.new_search()
+    return _negamax(state, depth, alpha, beta, SearchContext(depth, table, orderer))
+
+def _negamax(state, depth, alpha, beta, search):
+    """Recursive part of negamax. Makes and unmakes moves on state."""
+    search.nodes += 1
+    if search.deadline is not None and time.time() > search.deadline:
+        raise SearchTimeout()
+    
     if depth == 0:
-        utility = getUtility(game)
+        search.leaves += 1
+        utility = state.utility()
         return utility,(-1,-1),[]
         
-    legalMoves = getLegalMoves(game)
+    legalMoves = state.legal_moves()
     if len(legalMoves) == 0:
-        utility = getUtility(game)
+        search.leaves += 1
+        utility = state.utility()
         return utility,(-1,-1),[]
     
+    # Reuse an earlier search of this position if it went deep enough.
+    alphaOrig = alpha
+    table = search.table
+    entry = None
+    transform = 0 # Symmetry between this position and the one the table entry describes
+    if table is not None:
+        if depth >= SYMMETRY_DEPTH:
+            key, transform = Symmetry.canonical_key(state)
+        else:
+            key = state.key
+        entry = table.lookup(key)
+    firstMove = search.pv.get(state.key)
+    if entry is not None:
+        search.table_hits += 1
+        entryKey, entryDepth, entryValue, bound, entryMove, age = entry
+        if transform:
+            entryMove = Symmetry.unmap_move(entryMove, transform)
+        if entryDepth >= depth:
+            if bound == EXACT:
+                return entryValue, entryMove, [(entryMove, entryValue)]
+            elif bound == LOWER:
+                alpha = max(alpha, entryValue)
+            else:
+                beta = min(beta, entryValue)
+            if alpha >= beta:
+                return entryValue, entryMove, [(entryMove, entryValue)]
+        firstMove = firstMove or entryMove
+    
+    # Search the principal variation, or else the best move from an earlier search, first.
+    # Full ordering doesn't pay for itself just above the leaves, where each move is cheap to search.
+    ply = search.depth - depth
+    if search.orderer is not None and depth > 1:
+        search.orderer.order(state, legalMoves, firstMove, ply)
+    elif firstMove in legalMoves:
+        legalMoves.remove(firstMove)
+        legalMoves.insert(0, firstMove)
+    
     bestValue = float('-inf')
     bestMove = (-1,-1)
     bestPath = []
     for board, cell in legalMoves:
-        # Move on a copy of the game board.
-        tempGame = copy.deepcopy(game)
-        tempGame.move(board, cell, tempGame.userX if tempGame.moveX else tempGame.userO)
-        val, move, path = negamax(tempGame, depth-1, -beta, -alpha, path)
+        undo = state.make(board, cell)
+        val, move, path = _negamax(state, depth-1, -beta, -alpha, search)
+        state.unmake(undo)
         val = val*-1
         if val > bestValue:
             bestPath = path
@@ -76,7 +327,21 @@ def negamax(game, depth, alpha, beta, path):
         # Prune if alpha is greater than beta.
         alpha = max(alpha, val) 
         if alpha >= beta: 
+            search.cutoffs += 1
+            if (board, cell) == legalMoves[0]:
+                search.first_move_cutoffs += 1
+            if search.orderer is not None:
+                search.orderer.cutoff((board, cell), depth, ply)
             break
+    
+    if table is not None:
+        if bestValue <= alphaOrig:
+            bound = UPPER
+        elif bestValue >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        table.store(key, depth, bestValue, bound, Symmetry.map_move(bestMove, transform) if transform else bestMove)
     path = [(bestMove, bestValue)] + bestPath
     return bestValue, bestMove, path
     
@@ -84,30 +349,21 @@ def getUtility(game):
     """
     Returns liklihood that the current board will lead to a win for the current player. 
     
+    From X's point of view, the utility adds up:
+        - the chances for a win on each undecided miniboard (two pieces in a row)
+        - the number of miniboards won, times 10
+        - the chances for a win on the metaboard (two miniboards won in a row), times 15
+    Each term is a single lookup in a precomputed table (see Bitboard.py).
+    
     Arguments:
-        game: Game object to evaluate
+        game: Game, GameState or Bitboard to evaluate
         
     Return Value:
-        utility: Large numbers are good for the player who just played (!game.moveX)
+        utility: Large numbers are good for the player to move (game.moveX).
+                 -1000 if the player to move has lost.
     """
-    player_coef = 1 if game.moveX else -1
-    if game.winner:
-        return -1000
-    
-    # Count the chances for a win on a miniboard (two pieces in a row)
-    mini_win_chances = 0
-    for i in range(len(game.metaboard)):
-        if game.all_mini_wins[i] == ' ':
-            board = game.metaboard[i]
-            mini_win_chances += winChances(board, 'X')
-            mini_win_chances -= winChances(board, 'O')
-        
-    # Count the number of miniboards won
-    mini_wins = game.all_mini_wins.count('X') - game.all_mini_wins.count('O')
-    
-    # Count the chances for a win on the metaboard (two miniboards won in a row)
-    meta_win_chances = winChances(game.all_mini_wins, 'X') - winChances(game.all_mini_wins, 'O')
-    return (mini_win_chances + mini_wins*10 + meta_win_chances*15)*player_coef
+    state = game if isinstance(game, Bitboard) else Bitboard.from_game(game)
+    return state.utility()
     
 def winChances(board, player):
     """
@@ -120,24 +376,14 @@ def winChances(board, player):
         
     Return Value:
         Number of instances where player has two pieces in a row with third position empty.
-    
-    Note: this is slow. 
-    """
-    board = ''.join(board)
-    win_chance_patterns = [' XX......', 'X X......', 'XX ......', 
-                    '... XX...', '...X X...', '...XX ...', 
-                    '...... XX', '......X X', '......XX ', 
-                    ' ..X..X..', 'X.. ..X..', 'X..X.. ..', 
-                    '. ..X..X.', '.X.. ..X.', '.X..X.. .',
-                    '.. ..X..X', '..X.. ..X', '..X..X.. ',
-                    ' ...X...X', 'X... ...X', 'X...X... ',
-                    '.. .X.X..', '..X. .X..', '..X.X. ..']
-    if player == 'O': win_chance_patterns = map(lambda s: s.replace('X','O'), win_chance_patterns)
-    wins = map(lambda s: re.compile(s), win_chance_patterns)
-    result = 0
-    for win in wins:
-        if win.match(board): result += 1
-    return result
+    """
+    mine = theirs = 0
+    for cell in range(9):
+        if board[cell] == player:
+            mine |= 1 << cell
+        elif board[cell] != ' ':
+            theirs |= 1 << cell
+    return TWO_IN_A_ROW[mine | theirs << 9]
     
 def getLegalMoves(game): 
     """
@@ -145,7 +391,7 @@ def getLegalMoves(game):
     Useful for iterating over all possible moves in adversarial search.
     
     Arguments:
-        game: Game object to evaluate
+        game: Game or GameState to evaluate
     
     Return Value: 
         List of legal moves available to the current player. 
@@ -0,0 +1,159 @@
+"""
+Compute AI moves outside of the request that made them necessary.
+
+GameUpdater.make_move saves the human's move and pushes it to the players straight away,
+then calls schedule_ai_move. The AI's reply is computed by a background worker
+and pushed to the players when it is ready. After the AI has moved, the worker
+ponders the human's replies (see Ponder.py).
+
+The workers are shared by every game. To keep response times steady under load,
+each AI move gets a time budget that shrinks as the number of waiting moves grows
+(iterative deepening then just stops at a shallower depth), and pondering runs
+at a lower priority than moves and stops altogether when the AI is busy.
+Queue depth and wait/search times are counted in memcache: see get_stats().
+A failed AI move is retried (see queue.yaml), but each move is counted once.
+
+Two queues are available:
+    TaskQueue: App Engine push queues, via the deferred library. Used in production.
+    LocalQueue: a thread pool in the current process. A stand-in for development and tests.
+"""
+
+import logging
+import os
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from google.appengine.api import memcache
+from google.appengine.ext import deferred
+import GameCache
+import Ai
+import Ponder
+
+AI_QUEUE_NAME = 'ai' # Defined in queue.yaml, so AI workers can be scaled separately from web workers
+PONDER_QUEUE_NAME = 'ponder' # Lower priority than AI moves, also in queue.yaml
+
+CAPACITY = 4 # AI moves that can be searched at once with the full time budget
+MIN_BUDGET = 0.02 # Never search for less than this, however busy. Still gets a few plies.
+PONDER_LIMIT = 2 # Don't ponder while more than this many AI moves are waiting
+AI_RETRY_LIMIT = 2 # task_retry_limit of the ai queue in queue.yaml
+
+# Memcache counters
+PENDING = 'ai:pending' # AI moves queued or in progress
+MOVES = 'ai:moves' # AI moves started
+WAIT_MS = 'ai:wait_ms' # Total time AI moves spent queued
+SEARCH_MS = 'ai:search_ms' # Total time spent making AI moves
+
+def time_budget(pending, full_budget=Ai.TIME_BUDGET):
+    """Return the search time for an AI move when pending moves are waiting or in progress,
+    given the time it would get without any load."""
+    if pending <= CAPACITY:
+        return full_budget
+    return max(MIN_BUDGET, full_budget*CAPACITY/pending)
+
+def get_pending():
+    return memcache.get(PENDING) or 0
+
+def get_stats():
+    """Return a dictionary of AI queue statistics. Times are in milliseconds."""
+    counters = memcache.get_multi([PENDING, MOVES, WAIT_MS, SEARCH_MS])
+    moves = counters.get(MOVES) or 0
+    pending = counters.get(PENDING) or 0
+    return {'pending': pending,
+            'moves': moves,
+            'mean_wait': float(counters.get(WAIT_MS) or 0)/moves if moves else 0.0,
+            'mean_search': float(counters.get(SEARCH_MS) or 0)/moves if moves else 0.0,
+            'time_budget': time_budget(pending)}
+
+def _retry_count():
+    """Return how many times the current task has been retried, or None if it isn't run by a push queue."""
+    retries = os.environ.get('HTTP_X_APPENGINE_TASKRETRYCOUNT')
+    return int(retries) if retries is not None else None
+
+def play_ai_move(game_id, queued_at=None):
+    """
+    Load a game and make the AI's move in it, with a time budget to suit the load. Runs in the worker.
+    The move stays pending until it has been made, or its task fails for the last time.
+    """
+    from Main import GameUpdater # Imported here because Main imports this module
+    started = time.time()
+    retries = _retry_count()
+    if not retries: # Count the move and its wait on the first attempt only
+        memcache.incr(MOVES, initial_value=0)
+        if queued_at is not None:
+            memcache.incr(WAIT_MS, max(0, int((started - queued_at)*1000)), initial_value=0)
+    done = False
+    try:
+        game = GameCache.get(game_id)
+        if not game:
+            logging.warning('AI move requested for missing game %s', game_id)
+        else:
+            budget = time_budget(get_pending(), game.ai_time_budget or Ai.TIME_BUDGET)
+            GameUpdater(game).make_ai_move(time_budget=budget)
+        done = True
+    finally:
+        if done or retries is None or retries >= AI_RETRY_LIMIT: # Otherwise the task will be retried
+            memcache.decr(PENDING) # Never goes below 0
+            memcache.incr(SEARCH_MS, int((time.time() - started)*1000), initial_value=0)
+
+def ponder_game(game_id):
+    """Load a game and ponder the human's replies. Runs in the worker."""
+    if get_pending() > PONDER_LIMIT:
+        return # The workers are needed for real moves
+    game = GameCache.get(game_id)
+    if game and game.moveX and not game.winner: # Skip if the human has already replied
+        Ponder.ponder(game)
+
+class TaskQueue():
+    """Run AI moves on App Engine push queues."""
+
+    def add(self, function, args, background=False):
+        deferred.defer(function, *args, _queue=PONDER_QUEUE_NAME if background else AI_QUEUE_NAME)
+
+class LocalQueue():
+    """Run AI moves on a pool of threads in this process. Background tasks run after all others."""
+
+    def __init__(self, workers=2):
+        self.tasks = queue.PriorityQueue()
+        self.count = 0 # Keeps tasks of the same priority in order
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            priority, count, function, args = self.tasks.get()
+            try:
+                function(*args)
+            except Exception:
+                logging.exception('%s%r failed', function.__name__, args)
+            finally:
+                self.tasks.task_done()
+
+    def add(self, function, args, background=False):
+        self.count += 1
+        self.tasks.put((1 if background else 0, self.count, function, args))
+
+    def join(self):
+        """Wait until every queued move has been made."""
+        self.tasks.join()
+
+_queue = TaskQueue()
+
+def set_queue(new_queue):
+    """Choose where AI moves run, e.g. set_queue(LocalQueue()) in tests."""
+    global _queue
+    _queue = new_queue
+
+def schedule_ai_move(game):
+    """Queue up the AI's reply in a game."""
+    memcache.incr(PENDING, initial_value=0)
+    _queue.add(play_ai_move, (game.key().id(), time.time()))
+
+def schedule_ponder(game):
+    """Queue up pondering the human's replies in a game, if the AI isn't busy."""
+    if get_pending() <= PONDER_LIMIT:
+        _queue.add(ponder_game, (game.key().id(),), background=True)
@@ -0,0 +1,105 @@
+"""
+Evaluate many metaTicTacToe positions at once with NumPy.
+
+Bitboard evaluates one position at a time, which is right for the search
+but slow for bulk work: analysing stored games, scoring the positions of
+many playouts, or tuning the evaluation weights over millions of positions.
+evaluate() takes whole arrays of positions and returns the same heuristic
+scores as Bitboard.utility, the legal moves and the winner of each, using
+vectorized array operations only.
+
+A batch of N positions is given as arrays:
+    cells: N x 81 (or N x 9 x 9) integers, index board_num*9 + cell:
+        1 for X, -1 for O, 0 for empty
+    mini_wins: N x 9 integers, 1 where X won the miniboard, -1 where O did, 0 otherwise
+    moveX: N booleans, True where it is X's turn
+    last_cell: N integers, the miniboard to play in, or -1 if any may be played
+
+NumPy is optional. The rest of the AI doesn't need it, and this module
+can only be used where it is installed.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from Bitboard import LINES, MINI_WIN_WEIGHT, META_CHANCE_WEIGHT
+
+# LINE_CELLS[l] are the three cells of line l.
+LINE_CELLS = [[cell for cell in range(9) if line >> cell & 1] for line in LINES]
+
+def from_states(states):
+    """Return the arrays (cells, mini_wins, moveX, last_cell) for a list of Bitboards."""
+    count = len(states)
+    cells = numpy.zeros((count, 81), numpy.int8)
+    mini_wins = numpy.zeros((count, 9), numpy.int8)
+    for i, state in enumerate(states):
+        cells[i] = [(state.x >> square & 1) - (state.o >> square & 1) for square in range(81)] # Too wide for NumPy integers
+        mini_wins[i] = [(state.x_wins >> board_num & 1) - (state.o_wins >> board_num & 1) for board_num in range(9)]
+    moveX = numpy.array([state.moveX for state in states], bool)
+    last_cell = numpy.array([state.last_cell for state in states], numpy.int8)
+    return cells, mini_wins, moveX, last_cell
+
+def _two_in_a_row(boards):
+    """
+    Given an array of 3x3 boards (..., 9) of 1, -1 and 0, return X's two-in-a-row count
+    minus O's for each board: lines with two of a player's pieces and an empty third cell.
+    """
+    lines = boards[..., LINE_CELLS] # (..., 8 lines, 3 cells)
+    empty = (lines == 0).any(axis=-1)
+    x_twos = ((lines == 1).sum(axis=-1) == 2) & empty
+    o_twos = ((lines == -1).sum(axis=-1) == 2) & empty
+    return x_twos.sum(axis=-1) - o_twos.sum(axis=-1)
+
+def _three_in_a_row(boards, player):
+    """Return a boolean array: True for each 3x3 board where player (1 or -1) has a line."""
+    return (boards[..., LINE_CELLS] == player).all(axis=-1).any(axis=-1)
+
+def evaluate(cells, mini_wins=None, moveX=None, last_cell=None,
+             mini_win_weight=MINI_WIN_WEIGHT, meta_chance_weight=META_CHANCE_WEIGHT):
+    """
+    Evaluate a batch of positions.
+
+    Arguments:
+        cells: N x 81 or N x 9 x 9 array of pieces (see the module docstring)
+        mini_wins: N x 9 array of miniboard wins. If None, a miniboard is counted as won by a player
+            with three in a row on it. Where both players have one, only the order of the moves tells
+            who won it, so pass mini_wins for such positions.
+        moveX: N booleans. If None, it is X's turn iff both players have the same number of pieces.
+        last_cell: N miniboards to play in. If None, any miniboard may be played.
+        mini_win_weight, meta_chance_weight: weights of the evaluation terms (see Bitboard)
+
+    Return Value:
+        (scores, legal, winners):
+            scores: N integers, the heuristic value for the player to move, as Bitboard.utility
+            legal: N x 81 booleans, True for each legal move board_num*9 + cell
+            winners: N integers, 1 where X has won the game, -1 where O has, 0 otherwise
+    """
+    cells = numpy.asarray(cells).reshape(-1, 81)
+    count = len(cells)
+    boards = cells.reshape(count, 9, 9).astype(numpy.int32)
+    if mini_wins is None:
+        x_lines = _three_in_a_row(boards, 1)
+        o_lines = _three_in_a_row(boards, -1)
+        mini_wins = x_lines & ~o_lines
+        mini_wins = mini_wins.astype(numpy.int32) - (o_lines & ~x_lines)
+    mini_wins = numpy.asarray(mini_wins, numpy.int32).reshape(count, 9)
+    if moveX is None:
+        moveX = (cells == 1).sum(axis=1) == (cells == -1).sum(axis=1)
+    moveX = numpy.asarray(moveX, bool).reshape(count)
+    if last_cell is None:
+        last_cell = numpy.full(count, -1)
+    last_cell = numpy.asarray(last_cell).reshape(count)
+
+    winners = _three_in_a_row(mini_wins, 1).astype(numpy.int32) - _three_in_a_row(mini_wins, -1)
+
+    # Score for X: two-in-a-rows on undecided miniboards, and miniboards won and two-in-a-rows on the metaboard.
+    mini = numpy.where(mini_wins == 0, _two_in_a_row(boards), 0).sum(axis=1)
+    meta = mini_wins.sum(axis=1)*mini_win_weight + _two_in_a_row(mini_wins)*meta_chance_weight
+    scores = numpy.where(moveX, 1, -1)*(mini + meta)
+    scores = numpy.where(winners != 0, -1000, scores) # The player to move has lost
+
+    board_of = numpy.arange(81) // 9
+    allowed = (last_cell[:, None] == -1) | (board_of[None, :] == last_cell[:, None])
+    legal = (cells == 0) & allowed & (winners == 0)[:, None]
+    return scores, legal, winners
@@ -0,0 +1,233 @@
+"""
+Micro-benchmarks for the hot paths of the game model and the AI.
+
+Each benchmark times one function over a fixed corpus of positions from the
+early, middle and end of the game. The corpus comes from seeded random games,
+so it is the same on every run and every machine. Each benchmark is warmed
+up first and then timed several times; the median is reported, in
+microseconds per call.
+
+Results can be saved as JSON and compared against a saved baseline. The exit
+status is 1 if any benchmark got slower than the baseline by more than the
+threshold, so a build can fail on a regression.
+
+No App Engine services are used: games are built in memory and never stored.
+Only the Game benchmarks need the App Engine SDK, for db.Model; the rest run on
+GameState.
+
+Example:
+    python Benchmark.py --out baseline.json
+    (make changes)
+    python Benchmark.py --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+import Ai
+from Bitboard import Bitboard
+from GameState import GameState
+
+SEED = 20131101
+PHASES = (('early', 4), ('middle', 30), ('end', 60)) # Phase of the game, and moves played before it
+POSITIONS = 20 # Positions in the corpus for each phase
+WARMUP = 1 # Untimed runs before timing
+REPEAT = 7 # Timed runs. The median is reported.
+THRESHOLD = 1.2 # A benchmark regressed if it got this many times slower than the baseline
+
+def corpus(phase_plies, count=POSITIONS, seed=SEED):
+    """
+    Return count Bitboards, each after phase_plies random moves from the start,
+    in a game that isn't over yet.
+    """
+    rand = random.Random(seed + phase_plies)
+    positions = []
+    while len(positions) < count:
+        state = Bitboard()
+        for ply in range(phase_plies):
+            moves = state.legal_moves()
+            if not moves:
+                break
+            state.make(*moves[int(rand.random()*len(moves))]) # Not rand.choice: it differs between Python 2 and 3
+        if state.legal_moves():
+            positions.append(state)
+    return positions
+
+def _users():
+    """Two users to play a game between. They have keys, so moves can be checked, but are never stored."""
+    from Models import User # Imported here so the rest of this module works without App Engine
+    os.environ.setdefault('APPLICATION_ID', 'benchmark') # Keys need an application id
+    return User(key_name='x'), User(key_name='o')
+
+def _game(state, users):
+    from Models import Game
+    game = Game(userX=users[0], userO=users[1])
+    return state.to_game(game)
+
+def _game_state(state):
+    return GameState(state.metaboard, state.all_mini_wins, state.moveX, state.last_cell)
+
+# Each benchmark is a function prepare(positions, users) that returns (run, calls):
+# a function to time and the number of calls of the benchmarked function it makes.
+# prepare is called, untimed, before each timed run.
+
+def _game_move(positions, users):
+    games = [_game(state, users) for state in positions]
+    moves = [state.legal_moves()[0] for state in positions]
+    def run():
+        for game, (board_num, cell) in zip(games, moves):
+            game.move(board_num, cell, users[0] if game.moveX else users[1])
+    return run, len(games)
+
+def _game_check_win(positions, users):
+    games = [_game(state, users) for state in positions]
+    def run():
+        for game in games:
+            for board in game.metaboard:
+                game.check_win(board)
+            game.check_win(game.all_mini_wins)
+    return run, len(games)*10
+
+def _game_is_legal_move(positions, users):
+    games = [_game(state, users) for state in positions]
+    def run():
+        for game in games:
+            user = users[0] if game.moveX else users[1]
+            for board_num in range(9):
+                for cell in range(9):
+                    game.is_legal_move(board_num, cell, user)
+    return run, len(games)*81
+
+def _game_state_move(positions, users):
+    games = [_game_state(state) for state in positions]
+    moves = [state.legal_moves()[0] for state in positions]
+    def run():
+        for game, (board_num, cell) in zip(games, moves):
+            game.move(board_num, cell)
+    return run, len(games)
+
+def _get_legal_moves(positions, users):
+    games = [_game_state(state) for state in positions]
+    def run():
+        for game in games:
+            Ai.getLegalMoves(game)
+    return run, len(games)
+
+def _win_chances(positions, users):
+    boards = [board for state in positions for board in state.metaboard]
+    def run():
+        for board in boards:
+            Ai.winChances(board, 'X')
+            Ai.winChances(board, 'O')
+    return run, len(boards)*2
+
+def _get_utility(positions, users):
+    games = [_game_state(state) for state in positions]
+    def run():
+        for game in games:
+            Ai.getUtility(game)
+    return run, len(games)
+
+def _bitboard_make_unmake(positions, users):
+    states = [state.copy() for state in positions]
+    def run():
+        for state in states:
+            for move in state.legal_moves():
+                state.unmake(state.make(*move))
+    return run, sum(len(state.legal_moves()) for state in states)
+
+BENCHMARKS = [('Game.move', _game_move),
+              ('Game.check_win', _game_check_win),
+              ('Game.is_legal_move', _game_is_legal_move),
+              ('GameState.move', _game_state_move),
+              ('Ai.getLegalMoves', _get_legal_moves),
+              ('Ai.winChances', _win_chances),
+              ('Ai.getUtility', _get_utility),
+              ('Bitboard.make+unmake', _bitboard_make_unmake)]
+
+def time_benchmark(prepare, positions, users, warmup=WARMUP, repeat=REPEAT):
+    """Return the median time of a benchmark, in microseconds per call."""
+    timings = []
+    for run_number in range(warmup + repeat):
+        run, calls = prepare(positions, users)
+        started = timeit.default_timer()
+        run()
+        elapsed = timeit.default_timer() - started
+        if run_number >= warmup:
+            timings.append(elapsed*1e6/calls)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def run_all(names=None, warmup=WARMUP, repeat=REPEAT):
+    """
+    Run the benchmarks.
+
+    Arguments:
+        names: names of the benchmarks to run (see BENCHMARKS), or None for all
+        warmup: untimed runs before timing
+        repeat: timed runs
+
+    Return Value:
+        A report, as a dictionary: {'python': version, 'results': {benchmark name: {phase: microseconds}}}
+    """
+    selected = [(name, prepare) for name, prepare in BENCHMARKS if not names or name in names]
+    users = _users() if any(name.startswith('Game.') for name, prepare in selected) else None
+    corpora = [(phase, corpus(plies)) for phase, plies in PHASES]
+    results = {}
+    for name, prepare in selected:
+        results[name] = dict((phase, time_benchmark(prepare, positions, users, warmup, repeat))
+                             for phase, positions in corpora)
+    return {'python': platform.python_version(), 'results': results}
+
+def compare(report, baseline, threshold=THRESHOLD):
+    """
+    Compare a report with a baseline report.
+
+    Return Value:
+        List of (name, phase, baseline time, time, ratio) for each benchmark in both, slowest ratio first,
+        and a list of those among them that regressed by more than threshold.
+    """
+    rows = []
+    for name, phases in sorted(report['results'].items()):
+        for phase, micros in sorted(phases.items()):
+            before = baseline['results'].get(name, {}).get(phase)
+            if before:
+                rows.append((name, phase, before, micros, micros/before))
+    rows.sort(key=lambda row: -row[4])
+    return rows, [row for row in rows if row[4] > threshold]
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the hot paths of the metaTicTacToe game model and AI.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timed runs of each benchmark')
+    parser.add_argument('--warmup', type=int, default=WARMUP, help='untimed runs before timing')
+    parser.add_argument('--out', help='write the results to this file as JSON')
+    parser.add_argument('--baseline', help='compare with results saved with --out')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='fail if a benchmark is this many times slower than the baseline')
+    args = parser.parse_args()
+
+    report = run_all(args.names, args.warmup, args.repeat)
+    for name, prepare in BENCHMARKS:
+        if name in report['results']:
+            phases = report['results'][name]
+            print('%-22s' % name + ''.join('%8s %9.2fus' % (phase, phases[phase]) for phase, plies in PHASES))
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as saved:
+            rows, regressions = compare(report, json.load(saved), args.threshold)
+        print('')
+        for name, phase, before, micros, ratio in rows:
+            print('%-22s %-8s %9.2fus -> %9.2fus  %5.2fx%s' % (name, phase, before, micros, ratio,
+                                                               '  REGRESSION' if ratio > args.threshold else ''))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Compact game state for metaTicTacToe, used by the AI search.
+
+The pieces of each player are stored in a single 81-bit integer: bit
+board_num*9 + cell is set when the player has a piece in that cell.
+Miniboard wins are stored as a 9-bit mask per player.
+
+Moves are applied in place with make() and reverted with unmake(), so the
+search never has to copy a Game or rebuild its metaboard strings.
+The rules are the same as GameState.move in GameState.py.
+
+Each state also carries a Zobrist hash (key) of the position, updated
+incrementally by make and unmake, for use by the transposition table.
+
+The heuristic evaluation used by the AI (see utility()) is driven by lookup
+tables indexed by a pair of 9-bit masks, mine | theirs << 9, so that each
+miniboard is scored with a single list lookup. The total (score) is kept up
+to date by make and unmake, which only rescore the miniboard that changed.
+"""
+
+import random
+
+BOARD_MASK = 0x1FF # All nine cells of a miniboard (or all nine miniboards of the metaboard)
+
+# Three in a row, as 9-bit masks over the cells of a board.
+LINES = [0x007, 0x038, 0x1C0, # Rows
+         0x049, 0x092, 0x124, # Columns
+         0x111, 0x054]        # Diagonals
+
+# WINNING[mask] is True iff the 9-bit mask contains three in a row.
+WINNING = [any(mask & line == line for line in LINES) for mask in range(512)]
+
+# FREE_CELLS[occupied] lists the empty cells of a miniboard whose occupied cells are given as a mask.
+FREE_CELLS = [tuple(cell for cell in range(9) if not occupied >> cell & 1) for occupied in range(512)]
+
+# TWO_IN_A_ROW[mine | theirs << 9] is the number of lines where "mine" has two pieces and the third cell is empty.
+# MINI_SCORE[x | o << 9] is X's two-in-a-row count minus O's, for a miniboard.
+# META_SCORE[x_wins | o_wins << 9] is the metaboard term of the utility: miniboards won and
+# two-in-a-row counts on the metaboard, weighted.
+MINI_WIN_WEIGHT = 10
+META_CHANCE_WEIGHT = 15
+TWO_IN_A_ROW = [0]*(1 << 18)
+MINI_SCORE = [0]*(1 << 18)
+META_SCORE = [0]*(1 << 18)
+
+def _build_score_tables():
+    for mine in range(512):
+        for theirs in range(512):
+            if mine & theirs:
+                continue
+            empty = BOARD_MASK & ~(mine | theirs)
+            TWO_IN_A_ROW[mine | theirs << 9] = sum(1 for line in LINES
+                                                   if bin(mine & line).count('1') == 2 and empty & line)
+    for x in range(512):
+        for o in range(512):
+            if x & o:
+                continue
+            index = x | o << 9
+            MINI_SCORE[index] = TWO_IN_A_ROW[index] - TWO_IN_A_ROW[o | x << 9]
+            META_SCORE[index] = ((bin(x).count('1') - bin(o).count('1'))*MINI_WIN_WEIGHT
+                                 + MINI_SCORE[index]*META_CHANCE_WEIGHT)
+
+_build_score_tables()
+
+# Zobrist keys. Seeded so that keys are the same in every process.
+_random = random.Random(20131030)
+ZOBRIST_X = [_random.getrandbits(64) for square in range(81)]
+ZOBRIST_O = [_random.getrandbits(64) for square in range(81)]
+ZOBRIST_LAST_CELL = [_random.getrandbits(64) for last_cell in range(-1, 9)] # Indexed by last_cell + 1
+ZOBRIST_MOVE_X = _random.getrandbits(64)
+# Drawn last, so the keys of positions without miniboard wins (e.g. in the opening book) are unchanged
+ZOBRIST_X_WIN = [_random.getrandbits(64) for board_num in range(9)]
+ZOBRIST_O_WIN = [_random.getrandbits(64) for board_num in range(9)]
+
+class Bitboard(object):
+    """
+    Represent the state of a single game of meta-tic-tac-toe as bitboards.
+
+    Attributes:
+        x, o: 81-bit masks of the cells occupied by each player
+        x_wins, o_wins: 9-bit masks of the miniboards won by each player
+        moveX: True iff it is X's turn
+        last_cell: the miniboard to play in, or -1 if any miniboard may be played
+        winner: 'X' or 'O' once the metaboard is won, otherwise None
+        key: 64-bit Zobrist hash of the position (pieces, miniboard wins, player to move and last_cell)
+        score: heuristic value of the position for X, ignoring winner (see utility)
+    """
+    __slots__ = ('x', 'o', 'x_wins', 'o_wins', 'moveX', 'last_cell', 'winner', 'key', 'score')
+
+    def __init__(self, x=0, o=0, x_wins=0, o_wins=0, moveX=True, last_cell=-1, winner=None):
+        self.x = x
+        self.o = o
+        self.x_wins = x_wins
+        self.o_wins = o_wins
+        self.moveX = moveX
+        self.last_cell = last_cell
+        self.winner = winner
+        self.key = self.compute_key()
+        self.score = self.compute_score()
+
+    def compute_key(self):
+        """Compute the Zobrist hash of the position from scratch."""
+        key = ZOBRIST_LAST_CELL[self.last_cell + 1]
+        if self.moveX:
+            key ^= ZOBRIST_MOVE_X
+        for square in range(81):
+            if self.x >> square & 1:
+                key ^= ZOBRIST_X[square]
+            elif self.o >> square & 1:
+                key ^= ZOBRIST_O[square]
+        # Play goes on in won miniboards, so the same pieces can be reached with either player owning one
+        for board_num in range(9):
+            if self.x_wins >> board_num & 1:
+                key ^= ZOBRIST_X_WIN[board_num]
+            elif self.o_wins >> board_num & 1:
+                key ^= ZOBRIST_O_WIN[board_num]
+        return key
+
+    def compute_score(self):
+        """Compute the heuristic value of the position for X from scratch."""
+        x, o = self.x, self.o
+        decided = self.x_wins | self.o_wins
+        score = META_SCORE[self.x_wins | self.o_wins << 9]
+        for board_num in range(9):
+            if not decided >> board_num & 1:
+                shift = board_num*9
+                score += MINI_SCORE[x >> shift & BOARD_MASK | (o >> shift & BOARD_MASK) << 9]
+        return score
+
+    @classmethod
+    def from_strings(cls, metaboard, all_mini_wins, moveX, last_cell, winner=None):
+        """
+        Build a bitboard from the string representation used by Game.
+
+        Arguments:
+            metaboard: list of nine 9-character strings of 'X', 'O' and ' '
+            all_mini_wins: list of nine 'X', 'O' or ' '
+            moveX: True iff it is X's turn
+            last_cell: the miniboard to play in, or -1
+            winner: 'X', 'O' or None
+        """
+        x = o = x_wins = o_wins = 0
+        for board_num in range(9):
+            for cell in range(9):
+                piece = metaboard[board_num][cell]
+                if piece == 'X':
+                    x |= 1 << (board_num*9 + cell)
+                elif piece == 'O':
+                    o |= 1 << (board_num*9 + cell)
+            if all_mini_wins[board_num] == 'X':
+                x_wins |= 1 << board_num
+            elif all_mini_wins[board_num] == 'O':
+                o_wins |= 1 << board_num
+        return cls(x, o, x_wins, o_wins, moveX, last_cell, winner)
+
+    @classmethod
+    def from_game(cls, game):
+        """
+        Build a bitboard from a Game or a GameState.
+        The player who won is always the player who just moved.
+        """
+        winner = None
+        if game.winner:
+            winner = 'O' if game.moveX else 'X'
+        return cls.from_strings(game.metaboard, game.all_mini_wins, game.moveX, game.last_cell, winner)
+
+    def to_game(self, game):
+        """Write this state back onto a Game. Inverse of from_game."""
+        game.metaboard = self.metaboard
+        game.all_mini_wins = self.all_mini_wins
+        game.moveX = self.moveX
+        game.last_cell = self.last_cell
+        if self.winner:
+            user = game.userX if self.winner == 'X' else game.userO
+            game.winner = str(user.key().id())
+        else:
+            game.winner = None
+        return game
+
+    def copy(self):
+        state = Bitboard.__new__(Bitboard)
+        for name in Bitboard.__slots__:
+            setattr(state, name, getattr(self, name))
+        return state
+
+    @property
+    def metaboard(self):
+        """The metaboard as a list of nine 9-character strings, as stored on Game."""
+        result = []
+        for board_num in range(9):
+            board = [' ']*9
+            for cell in range(9):
+                bit = 1 << (board_num*9 + cell)
+                if self.x & bit:
+                    board[cell] = 'X'
+                elif self.o & bit:
+                    board[cell] = 'O'
+            result.append("".join(board))
+        return result
+
+    @property
+    def all_mini_wins(self):
+        """The miniboard wins as a list of nine 'X', 'O' or ' ', as stored on Game."""
+        result = []
+        for board_num in range(9):
+            if self.x_wins >> board_num & 1:
+                result.append('X')
+            elif self.o_wins >> board_num & 1:
+                result.append('O')
+            else:
+                result.append(' ')
+        return result
+
+    def board(self, board_num):
+        """Return the 9-bit masks (x, o) for a single miniboard."""
+        shift = board_num*9
+        return self.x >> shift & BOARD_MASK, self.o >> shift & BOARD_MASK
+
+    def utility(self):
+        """
+        Heuristic value of the position (see Ai.getUtility).
+        Large numbers are good for the player to move.
+        """
+        if self.winner:
+            return -1000
+        return self.score if self.moveX else -self.score
+
+    def legal_moves(self):
+        """
+        Return a list of legal moves available to the current player, as (board_num, cell).
+        Moves are listed in the same order as Ai.getLegalMoves.
+        """
+        if self.winner:
+            return []
+        occupied = self.x | self.o
+        boards = range(9) if self.last_cell == -1 else (self.last_cell,)
+        return [(board_num, cell) for board_num in boards
+                for cell in FREE_CELLS[occupied >> board_num*9 & BOARD_MASK]]
+
+    def make(self, board_num, cell):
+        """
+        Play a move for the current player. The move is assumed to be legal.
+
+        Return Value:
+            An undo record to pass to unmake: (board_num, cell, last_cell, mini_won, winner, key, score)
+            where last_cell, winner, key and score are the values from before the move and mini_won is
+            True iff the move won the miniboard.
+        """
+        undo_last_cell = self.last_cell
+        undo_winner = self.winner
+        undo_key = self.key
+        undo_score = self.score
+        mini_won = False
+        shift = board_num*9
+        square = shift + cell
+        bit = 1 << square
+        decided = (self.x_wins | self.o_wins) >> board_num & 1
+        if self.moveX:
+            self.x |= bit
+            self.key ^= ZOBRIST_X[square]
+            if not decided:
+                mine = self.x >> shift & BOARD_MASK
+                index = mine | (self.o >> shift & BOARD_MASK) << 9
+                before = index ^ 1 << cell
+                if WINNING[mine]:
+                    meta = self.x_wins | self.o_wins << 9
+                    self.x_wins |= 1 << board_num
+                    self.key ^= ZOBRIST_X_WIN[board_num]
+                    mini_won = True
+                    self.score += META_SCORE[meta | 1 << board_num] - META_SCORE[meta] - MINI_SCORE[before]
+                    if WINNING[self.x_wins]:
+                        self.winner = 'X'
+                else:
+                    self.score += MINI_SCORE[index] - MINI_SCORE[before]
+        else:
+            self.o |= bit
+            self.key ^= ZOBRIST_O[square]
+            if not decided:
+                mine = self.o >> shift & BOARD_MASK
+                index = (self.x >> shift & BOARD_MASK) | mine << 9
+                before = index ^ 1 << (cell + 9)
+                if WINNING[mine]:
+                    meta = self.x_wins | self.o_wins << 9
+                    self.o_wins |= 1 << board_num
+                    self.key ^= ZOBRIST_O_WIN[board_num]
+                    mini_won = True
+                    self.score += META_SCORE[meta | 1 << (board_num + 9)] - META_SCORE[meta] - MINI_SCORE[before]
+                    if WINNING[self.o_wins]:
+                        self.winner = 'O'
+                else:
+                    self.score += MINI_SCORE[index] - MINI_SCORE[before]
+
+        if (self.x | self.o) >> cell*9 & BOARD_MASK == BOARD_MASK:
+            self.last_cell = -1 # A special case where the miniboard to be played in is full
+        else:
+            self.last_cell = cell
+        self.moveX = not self.moveX
+        self.key ^= ZOBRIST_MOVE_X ^ ZOBRIST_LAST_CELL[undo_last_cell + 1] ^ ZOBRIST_LAST_CELL[self.last_cell + 1]
+        return (board_num, cell, undo_last_cell, mini_won, undo_winner, undo_key, undo_score)
+
+    def unmake(self, undo):
+        """Revert the move described by an undo record returned from make."""
+        board_num, cell, last_cell, mini_won, winner, key, score = undo
+        self.moveX = not self.moveX
+        bit = ~(1 << (board_num*9 + cell))
+        if self.moveX:
+            self.x &= bit
+            if mini_won:
+                self.x_wins &= ~(1 << board_num)
+        else:
+            self.o &= bit
+            if mini_won:
+                self.o_wins &= ~(1 << board_num)
+        self.last_cell = last_cell
+        self.winner = winner
+        self.key = key
+        self.score = score
+
+    def __eq__(self, other):
+        return (isinstance(other, Bitboard) and
+                (self.x, self.o, self.x_wins, self.o_wins, self.moveX, self.last_cell, self.winner) ==
+                (other.x, other.o, other.x_wins, other.o_wins, other.moveX, other.last_cell, other.winner))
+
+    def __ne__(self, other):
+        return not self == other
@@ -0,0 +1,127 @@
+"""
+Exact endgame solver for metaTicTacToe.
+
+When few empty cells remain, the whole game tree is small enough to search to the end.
+solve() does that with alpha-beta and returns a proven result (win, loss or draw, and
+in how many moves) instead of a heuristic guess. Proven results are kept in a cache
+that lasts between searches, so later moves of the same game are solved almost for free.
+
+Values are from the point of view of the player to move:
+    WIN - n: the player to move wins in n moves (plies)
+    -(WIN - n): the player to move loses in n moves
+    0: a draw
+"""
+
+import time
+from Ordering import MoveOrderer
+from Transposition import EXACT, LOWER, UPPER
+
+WIN = 100000
+ENDGAME_CELLS = 24 # Only try to solve positions with at most this many empty cells
+CACHE_SIZE = 1 << 18 # Proven results kept between searches. The cache is emptied when it gets this big.
+
+_cache = {} # position key -> (value, bound, move), with win/loss distances counted from that position
+
+class SolveTimeout(Exception):
+    """Raised inside the solver when the deadline has passed."""
+    pass
+
+def worth_solving(state):
+    """Return True iff the position has few enough empty cells to try solving it."""
+    return 81 - bin(state.x | state.o).count('1') <= ENDGAME_CELLS
+
+def describe(value):
+    """Return ('win' | 'loss' | 'draw', moves to the end of the game) for a solved value."""
+    if value > 0:
+        return 'win', WIN - value
+    elif value < 0:
+        return 'loss', WIN + value
+    return 'draw', None
+
+def solve(state, time_budget=None):
+    """
+    Solve a position exactly.
+
+    Arguments:
+        state: Bitboard to solve (not modified)
+        time_budget: seconds to try for, or None to take as long as it takes
+
+    Return Value:
+        (value, move) with the value of the position and the best move for the player to move
+        (fastest win, or slowest loss), or None if the time budget ran out first.
+        The move is (-1,-1) if the game is already over.
+    """
+    if len(_cache) > CACHE_SIZE:
+        _cache.clear()
+    deadline = time.time() + time_budget if time_budget is not None else None
+    try:
+        value = _solve(state.copy(), float('-inf'), float('inf'), 0, deadline, MoveOrderer())
+    except SolveTimeout:
+        return None
+    if not state.legal_moves():
+        return value, (-1,-1) # Nothing was searched, so nothing was cached
+    return value, _cache[state.key][2]
+
+def _to_cache(value, ply):
+    """Make a win/loss distance relative to the position instead of the root of the search."""
+    if value > WIN // 2:
+        return value + ply
+    elif value < -WIN // 2:
+        return value - ply
+    return value
+
+def _from_cache(value, ply):
+    if value > WIN // 2:
+        return value - ply
+    elif value < -WIN // 2:
+        return value + ply
+    return value
+
+def _solve(state, alpha, beta, ply, deadline, orderer):
+    """Recursive part of solve. Returns the value of state, with distances counted from the root."""
+    if deadline is not None and time.time() > deadline:
+        raise SolveTimeout()
+    if state.winner:
+        return -(WIN - ply) # The player who just moved won
+    moves = state.legal_moves()
+    if not moves:
+        return 0 # The board is full
+
+    alphaOrig = alpha
+    firstMove = None
+    entry = _cache.get(state.key)
+    if entry is not None:
+        value, bound, firstMove = entry
+        value = _from_cache(value, ply)
+        if bound == EXACT:
+            return value
+        elif bound == LOWER:
+            alpha = max(alpha, value)
+        else:
+            beta = min(beta, value)
+        if alpha >= beta:
+            return value
+
+    orderer.order(state, moves, firstMove, ply)
+    bestValue = float('-inf')
+    bestMove = moves[0]
+    for move in moves:
+        undo = state.make(*move)
+        value = -_solve(state, -beta, -alpha, ply + 1, deadline, orderer)
+        state.unmake(undo)
+        if value > bestValue:
+            bestValue = value
+            bestMove = move
+        alpha = max(alpha, value)
+        if alpha >= beta:
+            orderer.cutoff(move, ENDGAME_CELLS - ply, ply)
+            break
+
+    if bestValue <= alphaOrig:
+        bound = UPPER
+    elif bestValue >= beta:
+        bound = LOWER
+    else:
+        bound = EXACT
+    _cache[state.key] = (_to_cache(bestValue, ply), bound, bestMove)
+    return bestValue
@@ -0,0 +1,171 @@
+"""
+Read-through, write-through cache of Game entities in memcache.
+
+Every request about a game loads it, and every move saves it. get() serves
+games from memcache and only reads the datastore on a miss; put() saves to
+the datastore and then updates memcache, so active games are normally read
+without touching the datastore.
+
+Each save increments Game.version, and the cache stores that version with
+the game. An entry is only ever replaced by a newer version (memcache
+compare-and-set), and is deleted if it can't be updated, so the cache never
+holds an older game than the datastore.
+
+Changes to an existing game go through update(), an optimistic compare-and-set
+on the version: the change is checked and applied to the game as loaded, and
+saved in a transaction only if nobody has saved the game since. Otherwise the
+game is reloaded from the datastore and the change is tried again, against
+the new state. Two requests racing to move (a double click, or both players)
+can't both succeed or lose a move; the loser's move is rechecked and rejected
+if it is no longer legal. Conflicts are counted in memcache: see get_stats().
+
+Two caches are available:
+    memcache.Client(): App Engine memcache. Used in production.
+    LocalCache: a dictionary in this process. A stand-in for development and tests.
+"""
+
+import logging
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import db
+from Models import Game
+
+EXPIRY = 3600 # Seconds to keep a game in the cache after it was last saved
+CAS_RETRIES = 3 # Attempts to update an entry that other requests keep changing
+UPDATE_RETRIES = 3 # Attempts to save a change to a game that other requests keep changing
+CONFLICTS = 'game:conflicts' # Memcache counter of updates that lost a race and were retried
+
+def _cache_key(game_id):
+    return 'game:%s' % game_id
+
+def serialize(game):
+    """Return (version, bytes, moves since the snapshot) for a game, as stored in the cache."""
+    return game.version, db.model_to_protobuf(game).Encode(), list(game.log) # A copy: LocalCache doesn't pickle
+
+def deserialize(data):
+    game = db.model_from_protobuf(entity_pb.EntityProto(data[1]))
+    game.replay(data[2])
+    return game
+
+class LocalCache():
+    """The parts of memcache.Client used here, in a dictionary in this process."""
+
+    def __init__(self):
+        self.values = {}
+        self.read = set() # Keys read with gets and not changed since
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def gets(self, key):
+        self.read.add(key)
+        return self.values.get(key)
+
+    def add(self, key, value, time=0):
+        if key in self.values:
+            return False
+        self.values[key] = value
+        self.read.discard(key)
+        return True
+
+    def cas(self, key, value, time=0):
+        if key not in self.read or key not in self.values:
+            return False
+        self.values[key] = value
+        self.read.discard(key)
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.read.discard(key)
+        return True
+
+_cache = memcache.Client()
+
+def set_cache(cache):
+    """Choose where games are cached, e.g. set_cache(LocalCache()) in tests."""
+    global _cache
+    _cache = cache
+
+def get(game_id):
+    """Return the game with the given id, or None if there is no such game."""
+    cached = _cache.get(_cache_key(game_id))
+    if cached is not None:
+        return deserialize(cached)
+    game = Game.load(game_id)
+    if game:
+        _cache.add(_cache_key(game_id), serialize(game), time=EXPIRY) # Doesn't replace a newer entry
+    return game
+
+def put(game):
+    """Save a game to the datastore and the cache."""
+    game.version = (game.version or 0) + 1
+    game.put()
+    _store(game)
+
+def update(game, change):
+    """
+    Apply a change to a game and save it, unless it was saved by someone else since it was loaded.
+    
+    Arguments:
+        game: the game as loaded (e.g. by get)
+        change: function called as change(game) that changes the game and returns True,
+                or returns False without changing it if the change isn't allowed (e.g. an illegal move).
+                It may be called again on a newer copy of the game.
+    
+    Return Value:
+        The saved game, or None if the change wasn't allowed or kept conflicting.
+        Use the returned game afterwards: it may be a newer copy than the one passed in.
+    """
+    game_id = game.key().id()
+    for attempt in range(UPDATE_RETRIES):
+        loaded = game.version or 0
+        if not change(game):
+            return None
+        game.version = loaded + 1
+        try:
+            if db.run_in_transaction(_put_if_version, game, loaded):
+                _store(game)
+                return game
+        except db.TransactionFailedError:
+            pass
+        memcache.incr(CONFLICTS, initial_value=0)
+        logging.info('Conflicting update to game %s version %s, attempt %d', game_id, loaded, attempt + 1)
+        game = Game.load(game_id) # Not get(): the cached copy may be the stale one
+        if not game:
+            return None
+        _store(game)
+    logging.warning('Gave up updating game %s after %d conflicts', game_id, UPDATE_RETRIES)
+    return None
+
+def _put_if_version(game, version):
+    """Save a game iff the stored game has the given version. Runs in a transaction."""
+    stored = Game.get(game.key())
+    if stored is None or (stored.version or 0) != version:
+        return False
+    game.put()
+    return True
+
+def get_stats():
+    """Return a dictionary of game update statistics."""
+    return {'conflicts': memcache.get(CONFLICTS) or 0}
+
+def _store(game):
+    """Cache a game, unless a newer version is already cached."""
+    key = _cache_key(game.key().id())
+    data = serialize(game)
+    for attempt in range(CAS_RETRIES):
+        cached = _cache.gets(key)
+        if cached is None:
+            if _cache.add(key, data, time=EXPIRY):
+                return
+        elif cached[0] >= game.version:
+            return
+        elif _cache.cas(key, data, time=EXPIRY):
+            return
+    logging.warning('Failed to cache game %s version %s', game.key().id(), game.version)
+    _cache.delete(key) # Don't leave an older version behind
+
+def invalidate(game_id):
+    """Drop a game from the cache, e.g. after changing it without put()."""
+    _cache.delete(_cache_key(game_id))
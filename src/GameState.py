@@ -0,0 +1,131 @@
+"""
+The rules of metaTicTacToe, without App Engine.
+
+GameState holds the state of a game in the same form as Game in Models.py
+(a metaboard of nine strings, miniboard wins, whose turn it is and the
+miniboard to play in), and implements the rules: which moves are legal,
+and what a move does. It knows nothing about users or the datastore, so
+search, benchmarks and batch tools can create and play games cheaply.
+
+Game delegates its rules to GameState (see Game.to_state and Game.set_state).
+"""
+
+import re
+
+# Some naming conventions:
+# Cell: the index of a cell (0-8)
+# Board or miniboard: a string or list representing one of the nine smaller boards
+# Board_num: the index of a miniboard (0-8)
+# Metaboard: a list of nine miniboards
+
+class GameState(object):
+    """
+    Represent the state of a single game of meta-tic-tac-toe.
+
+    Attributes:
+        metaboard: list of nine 9-character strings of 'X', 'O' and ' '
+        all_mini_wins: list of nine 'X', 'O' or ' '
+        moveX: True iff it is X's turn
+        last_cell: the miniboard to play in, or -1 if any miniboard may be played
+        winner: 'X' or 'O' once the metaboard is won, otherwise None
+    """
+    __slots__ = ('metaboard', 'all_mini_wins', 'moveX', 'last_cell', 'winner')
+
+    def __init__(self, metaboard=None, all_mini_wins=None, moveX=True, last_cell=-1, winner=None):
+        self.metaboard = list(metaboard) if metaboard is not None else ['         ']*9
+        self.all_mini_wins = list(all_mini_wins) if all_mini_wins is not None else [' ']*9
+        self.moveX = moveX
+        self.last_cell = last_cell
+        self.winner = winner
+
+    def copy(self):
+        return GameState(self.metaboard, self.all_mini_wins, self.moveX, self.last_cell, self.winner)
+
+    def check_win(self, board):
+        """
+        Check if a board contains three of the same piece in a row. Works on mini or metaboard
+
+        Arugments:
+            board: string representation of a miniboard
+                    OR list representation of all wins on a metaboard (normally self.all_mini_wins)
+
+        Return Value:
+            True iff the board has three of the current player's pieces in a row.
+        """
+        board = "".join(board)
+        if self.moveX:
+            # X just moved, check for X wins
+            wins = Wins.x_wins
+        else:
+            # O just moved, check for O wins
+            wins = Wins.o_wins
+        for win in wins:
+            if win.match(board):
+                return True
+        return False
+
+    def is_legal_move(self, board_num, cell):
+        """Return true iff the current player may move in this cell"""
+        if self.metaboard[board_num][cell] == ' ':
+            if (self.last_cell == -1 # Forced to move in already full board
+                or self.last_cell == board_num): # Normal move: board determined by last cell
+                return True
+        return False
+
+    def legal_moves(self):
+        """Return a list of legal moves available to the current player, as (board_num, cell)."""
+        if self.winner:
+            return []
+        boards = range(9) if self.last_cell == -1 else [self.last_cell]
+        return [(board_num, cell) for board_num in boards for cell in range(9)
+                if self.metaboard[board_num][cell] == ' ']
+
+    def move(self, board_num, cell):
+        """
+        Play a move for the current player, if it's legal.
+
+        Arguments:
+            board_num: the board to move in - 0-9, count across then down
+            cell: the cell to move in - 0-9, count across then down
+
+        Return Value:
+            True iff the move was legal and has been played.
+        """
+        if not self.is_legal_move(board_num, cell):
+            return False
+        board = list(self.metaboard[board_num])
+
+        # Place the move on the board:
+        currentPlayer = 'X' if self.moveX else 'O'
+        board[cell] = currentPlayer
+        self.metaboard[board_num] = "".join(board)
+
+        # Check for a win on the miniboard and the metaboard:
+        if self.all_mini_wins[board_num] == ' ' and self.check_win(board):
+            self.all_mini_wins[board_num] = currentPlayer
+            if self.check_win(self.all_mini_wins):
+                self.winner = currentPlayer
+
+        if ' ' in self.metaboard[cell]:
+            self.last_cell = cell
+        else:
+            self.last_cell = -1 # A special case where the miniboard to be played in is full
+
+        self.moveX = not self.moveX
+        return True
+
+class Wins():
+    """Store all possible miniboard wins as a list of strings, for pattern matching later on."""
+    x_win_patterns = ['XXX......',
+                    '...XXX...',
+                    '......XXX',
+                    'X..X..X..',
+                    '.X..X..X.',
+                    '..X..X..X',
+                    'X...X...X',
+                    '..X.X.X..']
+
+    o_win_patterns = [s.replace('X','O') for s in x_win_patterns]
+
+    x_wins = [re.compile(s) for s in x_win_patterns]
+    o_wins = [re.compile(s) for s in o_win_patterns]
@@ -6,10 +6,14 @@ This file controls the server-side interaction including
     -serving pages
     
 User identity is managed by browser cookies using gaesessions.
-Game updates are pushed to users via the Google Channel API.
+Game updates are pushed to users via the Google Channel API. After a move only the move
+itself is sent; the whole game is sent when a game page is opened, when player O joins,
+and to a client that asks for it because it missed an update (see GameUpdater).
 
-Datastore models (User and Game) are defined in Models.py
+Datastore models (User and Game) are defined in Models.py, and games are cached by GameCache.py
 AI strategy is defined in Ai.py
+The AI player and its personas are defined in Players.py
+AI moves are computed in the background by AiWorker.py
 
 Created 2013
 @author: vbrown
@@ -25,21 +29,33 @@ from google.appengine.ext.webapp import template
 from google.appengine.ext.webapp.util import run_wsgi_app
 from gaesessions import get_current_session
 from Models import User, Game
+from GameState import GameState
 import Ai
-
-AI_ID = 1002 # The computer player (AI) is represented by a special user in the datastore.
-# Using 6192449487634432 for dev appserver.
+import AiWorker
+import Ponder
+import Players
+import GameCache
 
 class GameUpdater():
-    """Manage all game logic, package game state, and send it to the client"""
+    """
+    Manage all game logic, package game state, and send it to the client.
+    
+    Messages are numbered with the game's version, which goes up by one every time the game
+    is saved. A snapshot message has the whole game state; a move message only has the move
+    just played and what it changed. A client applies a move whose number follows the last
+    message it applied, ignores older messages, and asks for a snapshot (SnapshotPage) if a
+    number is missing.
+    """
     game = None
     
     def __init__(self, game):
         self.game = game
     
     def get_game_message(self):
-        """Return a JSON object describing the game state"""
+        """Return a JSON object describing the whole game state"""
         gameUpdate = {
+            "type": "snapshot",
+            "seq": self.game.version or 0,
             "metaboard": self.game.metaboard,
             "userX": str(self.game.userX.key().id()),
             "userO": '' if not self.game.userO else str(self.game.userO.key().id()),
@@ -50,23 +66,76 @@ class GameUpdater():
         }
         return json.dumps(gameUpdate)
     
-    def send_update(self):
-        """Send the game state, via the channel, to userX and userO"""
-        message = self.get_game_message() # Package the game state as a JSON object
+    def get_move_message(self, board_num, cell):
+        """Return a JSON object describing the move just played in the given cell, and what it changed"""
+        moveUpdate = {
+            "type": "move",
+            "seq": self.game.version or 0,
+            "board_num": board_num,
+            "cell": cell,
+            "piece": self.game.metaboard[board_num][cell],
+            "last_cell": self.game.last_cell,
+            "moveX": self.game.moveX,
+        }
+        if self.won_miniboard(board_num, cell):
+            moveUpdate["mini_win"] = self.game.all_mini_wins[board_num]
+        if self.game.winner:
+            moveUpdate["winner"] = self.game.winner
+        return json.dumps(moveUpdate)
+    
+    def won_miniboard(self, board_num, cell):
+        """Return True iff the move just played in the given cell won its miniboard"""
+        piece = self.game.metaboard[board_num][cell]
+        if self.game.all_mini_wins[board_num] != piece:
+            return False
+        # A miniboard is only won once: the move won it unless it already had a line without the move
+        board = self.game.metaboard[board_num]
+        return not GameState(moveX=(piece == 'X')).check_win(board[:cell] + ' ' + board[cell + 1:])
+    
+    def send_update(self, message=None):
+        """Send a message (by default the whole game state), via the channel, to userX and userO"""
+        if message is None:
+            message = self.get_game_message() # Package the game state as a JSON object
         channel.send_message(str(self.game.userX.key().id()) + str(self.game.key()), message)
         if self.game.userO:
             channel.send_message(str(self.game.userO.key().id()) + str(self.game.key()), message)
     
     def make_move(self, board_num, cell, user):
-        """Get a move. If it's legal update the game state, save it, and send it to the client."""
-        if self.game.move(board_num, cell, user):
-            self.game.put() # Save the game state
-            self.send_update() # Send it to the client
-        if self.game.userO == User.get_by_id(AI_ID): # Check if player O is AI - need to fix the check
-            board_num, cell = Ai.nextMove(self.game)
-            if self.game.move(board_num, cell, self.game.userO):
-                self.game.put()
-                self.send_update()
+        """Get a move. If it's legal update the game state, save it, and send it to the client.
+        If player O is the AI, reply with the move it prepared while pondering,
+        or else queue up its reply without waiting for it."""
+        game = GameCache.update(self.game, lambda game: game.move(board_num, cell, user)) # Save the game state
+        if game:
+            self.game = game
+            self.send_update(self.get_move_message(board_num, cell)) # Send it to the client
+            if self.game.to_state().legal_moves() and Players.is_ai(self.game): # Not after a win or a draw
+                pondered = Ponder.lookup(self.game)
+                if pondered:
+                    self.make_ai_move(pondered)
+                else:
+                    AiWorker.schedule_ai_move(self.game)
+    
+    def make_ai_move(self, move=None, time_budget=Ai.TIME_BUDGET):
+        """Make the AI's move (computing it in time_budget seconds unless given), save it, and send it to the client.
+        Then queue up pondering the human's reply. Logs how much work the move took."""
+        if self.game.moveX or not self.game.to_state().legal_moves():
+            return # Not the AI's turn (e.g. the task ran twice), or the game is over
+        if move:
+            logging.info('AI move in game %s: pondered', self.game.key().id())
+        else:
+            stats = Ai.SearchStats()
+            move = Ai.nextMove(self.game, time_budget, stats=stats)
+            logging.info('AI move in game %s: %s', self.game.key().id(), stats)
+        board_num, cell = move
+        version = self.game.version
+        # The move was chosen for this version of the game: give up if it has changed since.
+        game = GameCache.update(self.game, lambda game: game.version == version and
+                                game.move(board_num, cell, game.userO))
+        if game:
+            self.game = game
+            self.send_update(self.get_move_message(board_num, cell))
+            if self.game.to_state().legal_moves():
+                AiWorker.schedule_ponder(self.game)
 
 class GameFromRequest():
     """Take a request with variable g (the game key) and return the game entity from the datastore"""
@@ -75,7 +144,7 @@ class GameFromRequest():
     def __init__(self, request):
         game_id = request.get('g') # The client passes the game key back in order to open up the channel
         if game_id:
-            self.game = Game.get_by_id(int(game_id))
+            self.game = GameCache.get(int(game_id))
     
     def get_game(self):
         return self.game
@@ -99,17 +168,24 @@ class UserFromSession():
         return self.user
     
 class PlayAi(webapp.RequestHandler):
-    """Add the Ai agent as player O and begin game play"""
+    """Add the Ai agent as player O and begin game play.
+    The optional variable p chooses the AI's persona (see Players.PERSONAS)."""
     def post(self):
         game = GameFromRequest(self.request).get_game()
-        ai = User.get_by_id(AI_ID)
-        if not ai:
-            logging.info('Failed to retrieve AI user')
-        if not game.userO:
-            game.userO = User.get_by_id(AI_ID)
-            game.put()
+        persona = self.request.get('p') or Players.DEFAULT_PERSONA
+        game = GameCache.update(game, lambda game: not game.userO and Players.assign(game, persona))
+        if game:
             GameUpdater(game).send_update()
         
+class AiStatsPage(webapp.RequestHandler):
+    """Report the AI queue depth and wait and search times, and the number of conflicting
+    game updates, as JSON (see AiWorker.get_stats and GameCache.get_stats)."""
+    def get(self):
+        stats = AiWorker.get_stats()
+        stats.update(GameCache.get_stats())
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(stats))
+
 class MovePage(webapp.RequestHandler):
     """Handle a game move from the client"""
     def post(self):
@@ -127,6 +203,14 @@ class OpenedPage(webapp.RequestHandler):
         game = GameFromRequest(self.request).get_game()
         GameUpdater(game).send_update()
 
+class SnapshotPage(webapp.RequestHandler):
+    """A client has missed an update. Send it, and only it, the whole game state as JSON."""
+    def post(self):
+        game = GameFromRequest(self.request).get_game()
+        if game:
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.out.write(GameUpdater(game).get_game_message())
+
 class NewGame(webapp.RequestHandler):
     """Create a new game and then redirect the client to that game."""
     def post(self):
@@ -136,7 +220,7 @@ class NewGame(webapp.RequestHandler):
                     last_cell = -1,
                     all_mini_wins = [' ']*9,
                     metaboard = ['         ']*9)
-        game.put()
+        GameCache.put(game)
         self.redirect('/game?g=' + str(game.key().id()))
 
 class GamePage(webapp.RequestHandler):
@@ -150,9 +234,13 @@ class GamePage(webapp.RequestHandler):
         game = GameFromRequest(self.request).get_game()
         
         # Assign player O
-        if user != game.userX and not game.userO:
-            game.userO = user
-            game.put()
+        if game and user != game.userX and not game.userO:
+            def join(game):
+                if game.userO:
+                    return False # Someone else joined first
+                game.userO = user
+                return True
+            game = GameCache.update(game, join) or GameCache.get(game.key().id())
 
         if game:
             token = channel.create_channel(str(user.key().id()) + str(game.key()))
@@ -189,7 +277,9 @@ application = webapp.WSGIApplication([
     ('/new', NewGame),
     ('/game', GamePage),
     ('/opened', OpenedPage),
+    ('/snapshot', SnapshotPage),
     ('/ai', PlayAi),
+    ('/ai/stats', AiStatsPage),
     ('/move', MovePage)], debug=True)
 
 def main():
@@ -0,0 +1,126 @@
+"""
+Monte Carlo Tree Search engine for metaTicTacToe.
+
+An alternative to the negamax search in Ai.py. Instead of a hand-tuned utility,
+it judges a move by playing many random games (playouts) from it, and spends more
+playouts on the moves that look best so far (UCT: Kocsis and Szepesvari, 2006).
+
+The search is anytime: it can stop after any number of playouts, so its strength
+grows smoothly with the time it is given instead of a whole ply at a time.
+The tree of each game is kept between moves, so the playouts already spent on
+the line that was actually played are reused.
+"""
+
+import math
+import random
+import time
+from collections import OrderedDict
+
+EXPLORATION = 1.4 # UCT exploration constant, about sqrt(2)
+MAX_TREES = 100 # Games whose trees are kept between moves
+
+_trees = OrderedDict() # tree id (normally the game id) -> root Node, least recently used first
+_random = random.Random()
+
+class Node(object):
+    """A position in the search tree, reached by playing move from its parent."""
+    __slots__ = ('move', 'parent', 'player', 'key', 'children', 'untried', 'visits', 'wins')
+
+    def __init__(self, state, move=None, parent=None):
+        self.move = move
+        self.parent = parent
+        self.player = 'O' if state.moveX else 'X' # The player who made move
+        self.key = state.key
+        self.children = []
+        self.untried = state.legal_moves()
+        self.visits = 0
+        self.wins = 0.0 # Wins for player, counting draws as half a win
+
+    def select(self):
+        """Return the child with the best upper confidence bound."""
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda child: child.wins/child.visits +
+                   EXPLORATION*math.sqrt(log_visits/child.visits))
+
+def playout(state, rand=_random):
+    """Play random moves on state until the game ends. Return the winner: 'X', 'O' or None for a draw."""
+    while True:
+        moves = state.legal_moves()
+        if not moves:
+            return state.winner
+        state.make(*rand.choice(moves))
+
+def _find(root, key, levels=2):
+    """Return the node for position key within levels moves of root, or None."""
+    if root is None:
+        return None
+    nodes = [root]
+    for level in range(levels + 1):
+        for node in nodes:
+            if node.key == key:
+                return node
+        nodes = [child for node in nodes for child in node.children]
+    return None
+
+def best_move(state, time_budget=None, playouts=None, tree_id=None, rand=_random):
+    """
+    Choose a move by Monte Carlo Tree Search.
+    Stops when time_budget seconds have passed or after the given number of playouts,
+    whichever comes first. At least one of the two must be given.
+
+    Arguments:
+        state: Bitboard to evaluate (not modified)
+        time_budget: seconds to search for, or None
+        playouts: number of playouts to run, or None
+        tree_id: reuse and keep the search tree under this id (normally the game id), or None
+        rand: random.Random to use, e.g. a seeded one for repeatable results
+
+    Return Value:
+        (move, visits): the most visited move, or (-1,-1) if there are no legal moves,
+        and the number of playouts behind the decision (including reused ones).
+    """
+    root = None
+    if tree_id is not None:
+        root = _find(_trees.pop(tree_id, None), state.key)
+    if root is None:
+        root = Node(state)
+    root.parent = None
+    if not root.untried and not root.children:
+        return (-1,-1), root.visits # The game is over
+
+    deadline = time.time() + time_budget if time_budget is not None else None
+    count = 0
+    while (playouts is None or count < playouts) and (deadline is None or time.time() < deadline):
+        node = root
+        current = state.copy()
+        # Selection: follow the best children down to a node with moves left to try.
+        while not node.untried and node.children:
+            node = node.select()
+            current.make(*node.move)
+        # Expansion: add one untried move to the tree.
+        if node.untried:
+            move = node.untried.pop(rand.randrange(len(node.untried)))
+            current.make(*move)
+            child = Node(current, move, node)
+            node.children.append(child)
+            node = child
+        # Simulation.
+        winner = playout(current, rand)
+        # Backpropagation.
+        while node is not None:
+            node.visits += 1
+            if winner == node.player:
+                node.wins += 1
+            elif winner is None:
+                node.wins += 0.5
+            node = node.parent
+        count += 1
+
+    if tree_id is not None:
+        _trees[tree_id] = root
+        while len(_trees) > MAX_TREES:
+            _trees.popitem(last=False)
+    if not root.children:
+        return (-1,-1), root.visits
+    best = max(root.children, key=lambda child: child.visits)
+    return best.move, root.visits
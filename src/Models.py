@@ -6,15 +6,14 @@ Created on Nov 1, 2013
 @author: vbrown 
 '''
 
-import re
 from google.appengine.ext import db
 import logging
+from GameState import GameState, Wins # Wins is imported for older callers
 
-# Some naming conventions:
-# Cell: the index of a cell (0-8)
-# Board or miniboard: a string or list representing one of the nine smaller boards
-# Board_num: the index of a miniboard (0-8)
-# Metaboard: a list of nine miniboards
+# Naming conventions for boards and cells are described in GameState.py
+
+SNAPSHOT_INTERVAL = 10 # Moves between snapshots of the board on the Game entity
+STATE_FIELDS = ('metaboard', 'all_mini_wins', 'moveX', 'last_cell')
 
 class User(db.Model):
     """
@@ -33,16 +32,132 @@ class User(db.Model):
 class Game(db.Model):
     """
     Represent a single game of meta-tic-tac-toe.
-    Includes functionality to update based on a new move. 
+    Includes functionality to update based on a new move.
+    The rules themselves are implemented by GameState, which doesn't need the datastore.
+    
+    Moves are stored as an append-only log of Move entities, children of the game.
+    The board (metaboard, all_mini_wins, moveX and last_cell) is only stored every
+    SNAPSHOT_INTERVAL moves, and when the game is won, as a snapshot on the game entity.
+    Load games with Game.load, which replays the moves since the snapshot.
+    The current board is in plain attributes with the same names, as before.
     """
     userX = db.ReferenceProperty(User, collection_name='userX')
     userO = db.ReferenceProperty(User, collection_name='userO')
-    moveX = db.BooleanProperty()
-    metaboard = db.StringListProperty()
-    last_cell = db.IntegerProperty()
-    all_mini_wins = db.StringListProperty()
+    # Snapshot of the board after snapshot_move moves. Stored under the names the board had before the move log.
+    snapshot_moveX = db.BooleanProperty(name='moveX')
+    snapshot_metaboard = db.StringListProperty(name='metaboard', indexed=False)
+    snapshot_last_cell = db.IntegerProperty(name='last_cell', indexed=False)
+    snapshot_all_mini_wins = db.StringListProperty(name='all_mini_wins', indexed=False)
+    snapshot_move = db.IntegerProperty()
+    move_count = db.IntegerProperty() # Moves played. None for games from before the move log, until loaded.
     winner = db.StringProperty()
     winning_board = db.StringProperty()
+    is_ai = db.BooleanProperty(default=False) # True iff player O is the AI (see Players.py)
+    ai_persona = db.StringProperty() # Name of the AI's persona: one of Players.PERSONAS
+    ai_engine = db.StringProperty(default='negamax') # How the AI searches in this game: one of Ai.ENGINES
+    ai_time_budget = db.FloatProperty() # Seconds the AI may search for each move, or None for Ai.TIME_BUDGET
+    version = db.IntegerProperty(default=0) # Incremented each time the game is saved (see GameCache.py)
+    
+    def __init__(self, *args, **kwargs):
+        # db passes property values by their datastore names. Loaded from the datastore (_from_entity),
+        # those are the snapshot's; otherwise they are the current board, which isn't a property.
+        board = {}
+        if not kwargs.get('_from_entity'):
+            board = dict((name, kwargs.pop(name)) for name in STATE_FIELDS if name in kwargs)
+        super(Game, self).__init__(*args, **kwargs)
+        # The current board: as given, or else the snapshot
+        for name in STATE_FIELDS:
+            setattr(self, name, board.get(name, getattr(self, 'snapshot_' + name)))
+        self.log = [] # (move number, board_num, cell) for each move since the snapshot
+        self.saved_moves = self.move_count # Moves already in the datastore
+    
+    @classmethod
+    def load(cls, game_id):
+        """Return the game with the given id, replaying the moves since its snapshot, or None."""
+        game = cls.get_by_id(game_id)
+        if game and (game.move_count or 0) > (game.snapshot_move or 0):
+            moves = game.get_moves(game.snapshot_move + 1, game.move_count)
+            game.replay([(move.number, move.board_num, move.cell) for move in moves])
+        return game
+    
+    def get_moves(self, first, last):
+        """Return the Move entities numbered first to last, with None for any not in the log."""
+        return Move.get_by_key_name([Move.key_name_for(number) for number in range(first, last + 1)], parent=self)
+    
+    def replay(self, log):
+        """Play the moves of a log (see self.log) on the board, as already saved."""
+        state = self.to_state()
+        for number, board_num, cell in log:
+            state.move(board_num, cell)
+        self.set_state(state)
+        self.log.extend(log)
+    
+    def state_at(self, move_number):
+        """
+        Return the state of the game after the given number of moves, as a GameState.
+        Return None if it isn't known: games from before the move log only know their moves since then.
+        """
+        self._count_moves()
+        if move_number > self.move_count or move_number < 0:
+            return None
+        if move_number >= self.snapshot_move:
+            state = GameState(self.snapshot_metaboard, self.snapshot_all_mini_wins,
+                              self.snapshot_moveX, self.snapshot_last_cell)
+            moves = [(board_num, cell) for number, board_num, cell in self.log if number <= move_number]
+        else:
+            state = GameState()
+            moves = self.get_moves(1, move_number) if move_number else []
+            if None in moves:
+                return None
+            moves = [(move.board_num, move.cell) for move in moves]
+        for board_num, cell in moves:
+            state.move(board_num, cell)
+        return state
+    
+    def _count_moves(self):
+        """Start counting moves in a game from before the move log: its snapshot is the board as it is now."""
+        if self.move_count is None and self.metaboard is not None:
+            self.move_count = self.saved_moves = sum(9 - board.count(' ') for board in self.metaboard)
+            self.take_snapshot()
+    
+    def take_snapshot(self):
+        """Store the current board on the game entity, so the moves so far don't need to be replayed."""
+        for name in STATE_FIELDS:
+            setattr(self, 'snapshot_' + name, getattr(self, name))
+        self.snapshot_move = self.move_count
+        self.log = []
+    
+    def put(self, **kwargs):
+        """Save the game, and append its new moves to the move log. Takes a snapshot if it's time to."""
+        self._count_moves()
+        if not self.is_saved():
+            super(Game, self).put(**kwargs) # The moves need the game's key
+        moves = [Move(parent=self, key_name=Move.key_name_for(number), number=number, board_num=board_num, cell=cell)
+                 for number, board_num, cell in self.log if number > self.saved_moves]
+        if self.move_count is not None and (not self.snapshot_metaboard or self.winner or
+                                            self.move_count - self.snapshot_move >= SNAPSHOT_INTERVAL):
+            self.take_snapshot()
+        key = db.put([self] + moves, **kwargs)[0]
+        self.saved_moves = self.move_count
+        return key
+    
+    def to_state(self):
+        """Return the state of the game as a GameState, which implements the rules."""
+        winner = None
+        if self.winner:
+            winner = 'O' if self.moveX else 'X' # The player who won is always the player who just moved
+        return GameState(self.metaboard, self.all_mini_wins, self.moveX, self.last_cell, winner)
+    
+    def set_state(self, state):
+        """Copy a GameState onto the game."""
+        self.metaboard = list(state.metaboard)
+        self.all_mini_wins = list(state.all_mini_wins)
+        self.moveX = state.moveX
+        self.last_cell = state.last_cell
+        if state.winner and not self.winner:
+            # Take the winner's id from the reference without fetching the user from the datastore
+            user = Game.userX if state.winner == 'X' else Game.userO
+            self.winner = str(user.get_value_for_datastore(self).id())
     
     def check_win(self, board):
         """
@@ -55,26 +170,13 @@ class Game(db.Model):
         Return Value: 
             True iff the board has three matching pieces in a row.
         """
-        board = "".join(board)
-        if self.moveX:
-            # X just moved, check for X wins
-            wins = Wins().x_wins
-        else:
-            # O just moved, check for O wins
-            wins = Wins().o_wins
-        for win in wins:
-            if win.match(board):
-                return True
-        return False
+        return self.to_state().check_win(board)
         
     def is_legal_move(self, board_num, cell, user):
         """Return true iff the move is legal for the given user"""
         if board_num >= 0 and user == self.userX or user == self.userO:
             if self.moveX == (user == self.userX): 
-                if self.metaboard[board_num][cell] == ' ':
-                    if (self.last_cell == -1 # Forced to move in already full board
-                        or self.last_cell == board_num): # Normal move: board determined by last cell
-                        return True
+                return self.to_state().is_legal_move(board_num, cell)
         return False
     
     def move(self, board_num, cell, user):
@@ -87,39 +189,20 @@ class Game(db.Model):
             user: the user making the move (User object)
         """
         if self.is_legal_move(board_num, cell, user):
-            board = list(self.metaboard[board_num])
-        
-            # Place the move on the board:
-            currentPlayer = 'X' if self.moveX else 'O'
-            board[cell] = currentPlayer
-            self.metaboard[board_num] = "".join(board)
-            
-            # Check for a win on the miniboard and the metaboard:
-            if self.all_mini_wins[board_num] == ' ' and self.check_win(board): 
-                self.all_mini_wins[board_num] = currentPlayer 
-                if self.check_win(self.all_mini_wins):
-                    self.winner = str(user.key().id())
-            
-            if ' ' in self.metaboard[cell]:
-                self.last_cell = cell
-            else:
-                self.last_cell = -1 # A special case where the miniboard to be played in is full
-
-            self.moveX = not self.moveX
+            self._count_moves()
+            state = self.to_state()
+            state.move(board_num, cell)
+            self.set_state(state)
+            self.move_count += 1
+            self.log.append((self.move_count, board_num, cell))
             return True
 
-class Wins():
-    """Store all possible miniboard wins as a list of strings, for pattern matching later on."""
-    x_win_patterns = ['XXX......',
-                    '...XXX...',
-                    '......XXX',
-                    'X..X..X..',
-                    '.X..X..X.',
-                    '..X..X..X',
-                    'X...X...X',
-                    '..X.X.X..']
-    
-    o_win_patterns = map(lambda s: s.replace('X','O'), x_win_patterns)
-    
-    x_wins = map(lambda s: re.compile(s), x_win_patterns)
-    o_wins = map(lambda s: re.compile(s), o_win_patterns)
+class Move(db.Model):
+    """One move of a game, in the game's move log. A child of the Game entity."""
+    number = db.IntegerProperty(indexed=False) # 1 for the first move of the game
+    board_num = db.IntegerProperty(indexed=False)
+    cell = db.IntegerProperty(indexed=False)
+    
+    @staticmethod
+    def key_name_for(number):
+        return '%03d' % number
@@ -0,0 +1,120 @@
+"""
+Opening book for the AI.
+
+The first moves of a game are the most expensive to search (up to 81 legal moves)
+but they are always the same positions. build() searches them deeply, offline,
+and saves the best move for each one. Ai.nextMove looks positions up here
+before it searches.
+
+Positions are stored in canonical form (see Symmetry.py), so one entry
+covers all eight symmetric versions of a position.
+
+The book is a binary file of fixed-size records, sorted by position key:
+    8 bytes: key of the canonical position (Bitboard.key, little endian)
+    1 byte: best move in the canonical position, as board_num*9 + cell
+
+To rebuild the book (no App Engine SDK is needed: the search runs on Bitboard):
+    python OpeningBook.py --plies 2 --time 10
+"""
+
+import argparse
+import logging
+import os
+import struct
+import time
+from Bitboard import Bitboard
+import Symmetry
+
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openingbook.bin')
+RECORD = struct.Struct('<QB')
+
+_book = None # Loaded on first lookup
+
+def load(path=BOOK_PATH):
+    """Read a book file into a dict of {position key: (board_num, cell)}. A missing file is an empty book."""
+    book = {}
+    if not os.path.exists(path):
+        return book
+    with open(path, 'rb') as f:
+        data = f.read()
+    for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+        key, move = RECORD.unpack_from(data, offset)
+        book[key] = divmod(move, 9)
+    return book
+
+def save(book, path=BOOK_PATH):
+    """Write a dict of {position key: (board_num, cell)} to a book file."""
+    with open(path, 'wb') as f:
+        for key in sorted(book):
+            board_num, cell = book[key]
+            f.write(RECORD.pack(key, board_num*9 + cell))
+
+def lookup(state):
+    """Return the book move for a Bitboard as (board_num, cell), or None if the position isn't in the book."""
+    global _book
+    if _book is None:
+        _book = load()
+    if not _book:
+        return None
+    canonical, t = Symmetry.canonical(state)
+    move = _book.get(canonical.key)
+    return Symmetry.unmap_move(move, t) if move else None
+
+def positions(plies):
+    """
+    Yield every position reachable from the start of the game in at most plies moves, once each.
+    Positions are yielded in canonical form, so symmetric positions are only yielded once.
+    """
+    start = Bitboard()
+    frontier = {start.key: start} # Keyed by canonical position key, to skip transpositions and symmetries
+    for ply in range(plies + 1):
+        following = {}
+        for state in frontier.values():
+            yield state
+            if ply == plies:
+                continue
+            for move in state.legal_moves():
+                child = state.copy()
+                child.make(*move)
+                child = Symmetry.canonical(child)[0]
+                following[child.key] = child
+        frontier = following
+
+def build(plies, time_budget, max_depth=None, workers=1):
+    """
+    Search every position of the first plies moves and return the book as a dict.
+
+    Arguments:
+        plies: how many moves into the game the book covers
+        time_budget: seconds to search each position for
+        max_depth: deepest depth to search each position to, or None
+        workers: processes to search with (see Parallel.py)
+    """
+    import Ai # Imported here because Ai imports this module
+    import Parallel
+    book = {}
+    start = time.time()
+    for state in positions(plies):
+        if not state.legal_moves():
+            continue
+        if workers > 1:
+            util, move, path = Parallel.parallel_search(state, time_budget, workers, max_depth)
+        else:
+            util, move, path = Ai.iterativeDeepening(state, time_budget, max_depth)
+        book[state.key] = move
+        logging.info('%d positions, %.0f seconds', len(book), time.time() - start)
+    return book
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the opening book for the metaTicTacToe AI.')
+    parser.add_argument('--plies', type=int, default=2, help='moves into the game to cover')
+    parser.add_argument('--time', type=float, default=10, help='seconds to search each position for')
+    parser.add_argument('--depth', type=int, default=None, help='deepest depth to search each position to')
+    parser.add_argument('--workers', type=int, default=1, help='processes to search with')
+    parser.add_argument('--out', default=BOOK_PATH, help='book file to write')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    save(build(args.plies, args.time, args.depth, args.workers), args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Move ordering for the AI search.
+
+Alpha-beta pruning cuts off the most when the best move is searched first.
+MoveOrderer sorts the legal moves of a position so that likely good moves come first:
+    1. the principal variation / transposition table move
+    2. moves that win a miniboard, then moves that block the opponent from winning one
+    3. killer moves: moves that caused a cutoff at the same ply elsewhere in the tree
+    4. everything else, by history score: how often the move has caused cutoffs so far
+Moves that send the opponent to a full miniboard (so they may play anywhere) are penalized.
+
+The search uses any object with the same order and cutoff methods, so other orderings can be plugged in.
+"""
+
+from Bitboard import BOARD_MASK, WINNING
+
+FIRST_MOVE = 1 << 30
+MINI_WIN = 1 << 20
+BLOCK = 1 << 19
+KILLER = 1 << 18
+FREE_CHOICE_PENALTY = 1 << 16
+HISTORY_MAX = (1 << 16) - 1 # History scores are halved when one passes this, so they never outweigh a killer
+
+class MoveOrderer(object):
+    """
+    Order moves using the PV move, miniboard wins and blocks, killer moves and a history table.
+    Keep one MoveOrderer for all iterations of a search so that killers and history carry over.
+    """
+
+    def __init__(self):
+        self.killers = {} # ply -> [newest killer, older killer]
+        self.history = [0]*81 # board_num*9 + cell -> cutoff score
+
+    def order(self, state, moves, first_move, ply):
+        """
+        Sort moves in place, best first.
+
+        Arguments:
+            state: the Bitboard the moves are legal in
+            moves: list of (board_num, cell)
+            first_move: move to search before all others (PV or transposition table move), or None
+            ply: distance from the root of the search
+        """
+        x, o = state.x, state.o
+        mine, theirs = (x, o) if state.moveX else (o, x)
+        decided = state.x_wins | state.o_wins
+        occupied = x | o
+        killers = self.killers.get(ply, ())
+        history = self.history
+        scores = {}
+        for move in moves:
+            if move == first_move:
+                scores[move] = FIRST_MOVE
+                continue
+            board_num, cell = move
+            shift = board_num*9
+            score = history[shift + cell]
+            if not decided >> board_num & 1:
+                if WINNING[mine >> shift & BOARD_MASK | 1 << cell]:
+                    score += MINI_WIN
+                elif WINNING[theirs >> shift & BOARD_MASK | 1 << cell]:
+                    score += BLOCK
+            if move in killers:
+                score += KILLER
+            target = occupied >> cell*9 & BOARD_MASK
+            if board_num == cell:
+                target |= 1 << cell
+            if target == BOARD_MASK:
+                score -= FREE_CHOICE_PENALTY
+            scores[move] = score
+        moves.sort(key=scores.get, reverse=True)
+
+    def cutoff(self, move, depth, ply):
+        """Record that move caused a beta cutoff with depth plies left to search."""
+        killers = self.killers.get(ply)
+        if not killers:
+            self.killers[ply] = [move]
+        elif killers[0] != move:
+            self.killers[ply] = [move, killers[0]]
+
+        history = self.history
+        square = move[0]*9 + move[1]
+        history[square] += depth*depth
+        if history[square] > HISTORY_MAX:
+            self.history = [score >> 1 for score in history]
@@ -0,0 +1,116 @@
+"""
+Parallel root search for the AI.
+
+The legal moves at the root are split between a pool of worker processes.
+Each worker searches the position after one root move, by iterative deepening
+within its share of the time budget, and reports the value it found at every
+depth it completed. The root move is then chosen by comparing values at the
+deepest depth that every move reached, so that all moves are compared fairly.
+
+With deterministic=True the time budget is ignored and every move is searched
+to the same fixed depth, so the result doesn't depend on machine load.
+
+Process pools are not available on App Engine front-end instances;
+there the moves are searched one after another in the current process.
+"""
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+import Ai
+from Bitboard import Bitboard
+from Ordering import MoveOrderer
+from Transposition import TranspositionTable
+
+MIN_MOVE_BUDGET = 0.01 # Seconds. Every root move gets at least this long.
+
+_pool = None
+_pool_size = 0
+
+def _get_pool(workers):
+    """Return a process pool with the given number of workers, reusing it between searches."""
+    global _pool, _pool_size
+    if _pool is None or _pool_size != workers:
+        if _pool is not None:
+            _pool.terminate()
+        _pool = multiprocessing.Pool(workers)
+        _pool_size = workers
+    return _pool
+
+def _search_move(task):
+    """
+    Search one root move. Runs in a worker process.
+
+    Arguments:
+        task: (fields, move, time_budget, max_depth) where fields are the Bitboard constructor arguments
+              and time_budget is None for a fixed-depth search to max_depth
+
+    Return Value:
+        (move, values, final) where values maps root depth to the value of the move for the player
+        at the root, and final is True iff searching deeper would not change the value.
+    """
+    fields, move, time_budget, max_depth = task
+    state = Bitboard(*fields)
+    state.make(*move)
+    if time_budget is None:
+        value = Ai.negamax(state, max_depth - 1, float('-inf'), float('inf'),
+                           table=TranspositionTable(), orderer=MoveOrderer())[0]
+        return move, {max_depth: -value}, False
+
+    values = {1: -state.utility()}
+    def record(depth, result):
+        values[depth + 1] = -result[0]
+    cells_remaining = 81 - bin(state.x | state.o).count('1')
+    child_depth = cells_remaining if max_depth is None else min(max_depth - 1, cells_remaining)
+    if child_depth > 0 and state.legal_moves():
+        Ai.iterativeDeepening(state, time_budget, child_depth, on_iteration=record)
+    last = max(values)
+    final = last - 1 >= child_depth or abs(values[last]) >= 1000 or not state.legal_moves()
+    return move, values, final
+
+def parallel_search(state, time_budget, workers, max_depth=None, deterministic=False):
+    """
+    Search the root moves of a position in parallel.
+
+    Arguments:
+        state: Bitboard to evaluate (not modified)
+        time_budget: seconds to search for (ignored if deterministic)
+        workers: number of worker processes. 1 searches in the current process.
+        max_depth: deepest depth to search. Required if deterministic.
+        deterministic: search every move to exactly max_depth
+
+    Return Value:
+        (utility, move, path) like Ai.iterativeDeepening, except that path only holds the root move.
+        Ties are broken in favour of the move that Ai.getLegalMoves lists first.
+    """
+    moves = state.legal_moves()
+    if not moves:
+        return state.utility(), (-1,-1), []
+
+    fields = (state.x, state.o, state.x_wins, state.o_wins, state.moveX, state.last_cell, state.winner)
+    in_pool = workers > 1 and multiprocessing is not None
+    if deterministic:
+        tasks = [(fields, move, None, max_depth) for move in moves]
+    else:
+        # Each move gets an equal share of the total search time: of every worker's time in a pool,
+        # or of this process's time if the moves are searched one after another.
+        move_budget = max(MIN_MOVE_BUDGET, float(time_budget)*(workers if in_pool else 1)/len(moves))
+        tasks = [(fields, move, move_budget, max_depth) for move in moves]
+
+    if in_pool:
+        results = _get_pool(workers).map(_search_move, tasks, 1)
+    else:
+        results = [_search_move(task) for task in tasks]
+
+    # Compare the moves at the deepest depth all of them reached.
+    # A final value holds at any depth.
+    unfinished = [max(values) for move, values, final in results if not final]
+    depth = min(unfinished) if unfinished else max(max(values) for move, values, final in results)
+    def value_at(values):
+        return values[depth] if depth in values else values[max(values)]
+    best = max(range(len(results)), key=lambda i: (value_at(results[i][1]), -i))
+    move, values, final = results[best]
+    value = value_at(values)
+    return value, move, [(move, value)]
@@ -0,0 +1,83 @@
+"""
+The computer player (AI) and its personas.
+
+The AI is represented by a special user in the datastore, whose id depends on
+the environment: set the AI_USER_ID environment variable to choose it, or the
+id of the production or development user is used. The user is fetched once
+per process and cached.
+
+A game against the AI records it on the Game itself (is_ai, and the persona's
+engine and time budget), so handling a move never needs to look the AI up.
+
+Personas are ways for the AI to play: each has its own engine and time budget.
+"""
+
+import logging
+import os
+from Models import User, Game
+import Ai
+
+PRODUCTION_AI_ID = 1002
+DEVELOPMENT_AI_ID = 6192449487634432 # The AI user in the dev appserver's datastore
+
+class Persona():
+    """A way for the AI to play."""
+
+    def __init__(self, name, engine, time_budget, description):
+        self.name = name
+        self.engine = engine # One of Ai.ENGINES
+        self.time_budget = time_budget # Seconds to search for each move
+        self.description = description
+
+PERSONAS = dict((persona.name, persona) for persona in [
+    Persona('standard', 'negamax', Ai.TIME_BUDGET, 'Alpha-beta search'),
+    Persona('quick', 'negamax', 0.05, 'A shallower, weaker alpha-beta search'),
+    Persona('deep', 'negamax', 1.0, 'A deeper, slower alpha-beta search'),
+    Persona('mcts', 'mcts', Ai.TIME_BUDGET, 'Monte Carlo Tree Search')])
+DEFAULT_PERSONA = 'standard'
+
+_ai_user = None # Cached AI user
+
+def ai_user_id():
+    """Return the datastore id of the AI user in this environment."""
+    if os.environ.get('AI_USER_ID'):
+        return int(os.environ['AI_USER_ID'])
+    if os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+        return DEVELOPMENT_AI_ID
+    return PRODUCTION_AI_ID
+
+def get_ai_user():
+    """Return the AI user, or None if it isn't in the datastore. Only fetched once per process."""
+    global _ai_user
+    if _ai_user is None:
+        _ai_user = User.get_by_id(ai_user_id())
+        if not _ai_user:
+            logging.error('Failed to retrieve AI user %s', ai_user_id())
+    return _ai_user
+
+def is_ai(game):
+    """Return True iff player O is the AI. Needs no datastore access."""
+    if game.is_ai:
+        return True
+    # Games from before is_ai was stored: compare the key of player O without fetching it.
+    userO = Game.userO.get_value_for_datastore(game)
+    return userO is not None and userO.id() == ai_user_id()
+
+def assign(game, persona_name=DEFAULT_PERSONA):
+    """
+    Make the AI player O of a game, playing as the named persona (or the default one, if unknown).
+    Doesn't save the game.
+
+    Return Value:
+        True iff the AI was assigned.
+    """
+    ai = get_ai_user()
+    if not ai:
+        return False
+    persona = PERSONAS.get(persona_name, PERSONAS[DEFAULT_PERSONA])
+    game.userO = ai
+    game.is_ai = True
+    game.ai_persona = persona.name
+    game.ai_engine = persona.engine
+    game.ai_time_budget = persona.time_budget
+    return True
@@ -0,0 +1,66 @@
+"""
+Pondering: let the AI think on the human's time.
+
+After the AI moves, the human usually takes many seconds to reply while the
+server sits idle. ponder() uses that time to search the AI's answer to each of
+the human's likely replies, and stores the answers in memcache keyed by game
+and position. When the human's move arrives, GameUpdater.make_move looks the
+new position up and plays the prepared answer straight away.
+
+With the MCTS engine, pondering just grows the game's search tree instead;
+the next AI move reuses it (see Mcts.py).
+"""
+
+from google.appengine.api import memcache
+import Ai
+import Mcts
+from Bitboard import Bitboard
+from Ordering import MoveOrderer
+
+PONDER_BUDGET = 5.0 # Seconds to ponder for after each AI move
+GUESS_SHARE = 0.1 # Share of the budget spent guessing the human's best reply
+MAX_REPLIES = 9 # Prepare answers to at most this many replies, most likely first
+EXPIRY = 600 # Seconds to keep prepared answers
+
+def _cache_key(game_id):
+    return 'ponder:%s' % game_id
+
+def ponder(game, time_budget=PONDER_BUDGET):
+    """
+    Prepare the AI's answers to the human's likely replies.
+    Call when the AI has just moved and it is the human's turn.
+    """
+    state = Bitboard.from_game(game)
+    game_id = game.key().id()
+    replies = state.legal_moves()
+    if not replies:
+        return
+    if game.ai_engine == 'mcts':
+        Mcts.best_move(state, time_budget, tree_id=game_id)
+        return
+
+    # Most likely replies first: the human's best move by a short search, then by move ordering.
+    guess = Ai.iterativeDeepening(state, time_budget*GUESS_SHARE)[1]
+    MoveOrderer().order(state, replies, guess, 0)
+    replies = replies[:MAX_REPLIES]
+
+    # No longer than the AI would search for the move itself: a pondered answer is no stronger than its persona.
+    share = min(time_budget*(1 - GUESS_SHARE)/len(replies), game.ai_time_budget or Ai.TIME_BUDGET)
+    answers = {}
+    for reply in replies:
+        undo = state.make(*reply)
+        if state.legal_moves():
+            answers[state.key] = Ai.chooseMove(state, share, game.ai_engine)
+            memcache.set(_cache_key(game_id), answers, time=EXPIRY) # Save as we go: the human may reply any time
+        state.unmake(undo)
+
+def lookup(game):
+    """Return the prepared AI move for the current position of a game, or None."""
+    answers = memcache.get(_cache_key(game.key().id()))
+    if not answers:
+        return None
+    state = Bitboard.from_game(game)
+    move = answers.get(state.key)
+    if move in state.legal_moves():
+        return move
+    return None
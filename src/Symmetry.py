@@ -0,0 +1,89 @@
+"""
+Symmetries of the metaTicTacToe board.
+
+Rotating or reflecting the whole board doesn't change the game, as long as the
+same transformation is applied to the miniboard index and to the cell index
+(a move in the top left cell of the top left board stays a move in a corner
+cell of a corner board, and still sends the opponent to the matching board).
+There are eight such transformations: four rotations and four reflections.
+
+canonical() maps a position to a single representative of its eight
+symmetric positions, plus the transformation that gets there. Caches keyed
+by the canonical position (opening book, endgame results, transposition
+table) hold one entry for all eight, and moves are mapped back to the
+original position with unmap_move.
+"""
+
+from Bitboard import Bitboard, BOARD_MASK
+
+def _cell(row, column):
+    return row*3 + column
+
+# TRANSFORMS[t][i] is where index i (a cell or a board number) ends up under transformation t.
+_MAPS = [lambda r, c: (r, c),         # Identity
+         lambda r, c: (c, 2 - r),     # Rotate 90 degrees clockwise
+         lambda r, c: (2 - r, 2 - c), # Rotate 180 degrees
+         lambda r, c: (2 - c, r),     # Rotate 270 degrees clockwise
+         lambda r, c: (r, 2 - c),     # Reflect left-right
+         lambda r, c: (2 - r, c),     # Reflect top-bottom
+         lambda r, c: (c, r),         # Reflect in the main diagonal
+         lambda r, c: (2 - c, 2 - r)] # Reflect in the other diagonal
+TRANSFORMS = [tuple(_cell(*f(i // 3, i % 3)) for i in range(9)) for f in _MAPS]
+
+# INVERSE[t] is the transformation that undoes t.
+INVERSE = [[u for u in range(8) if all(TRANSFORMS[u][TRANSFORMS[t][i]] == i for i in range(9))][0]
+           for t in range(8)]
+
+# PERMUTED[t][mask] is a 9-bit mask after transformation t.
+PERMUTED = [[sum(1 << perm[i] for i in range(9) if mask >> i & 1) for mask in range(512)]
+            for perm in TRANSFORMS]
+
+def _permute(pieces, t):
+    """Apply transformation t to an 81-bit mask of pieces."""
+    perm = TRANSFORMS[t]
+    table = PERMUTED[t]
+    result = 0
+    for board_num in range(9):
+        result |= table[pieces >> board_num*9 & BOARD_MASK] << perm[board_num]*9
+    return result
+
+def transform(state, t):
+    """Return a new Bitboard: state after transformation t."""
+    table = PERMUTED[t]
+    last_cell = TRANSFORMS[t][state.last_cell] if state.last_cell != -1 else -1
+    return Bitboard(_permute(state.x, t), _permute(state.o, t), table[state.x_wins], table[state.o_wins],
+                    state.moveX, last_cell, state.winner)
+
+def canonical_key(state):
+    """
+    Return (key, t) where key is the Zobrist key of the canonical form of the position
+    (see canonical) and t is the transformation from state to it.
+    """
+    canonical_state, t = canonical(state)
+    return canonical_state.key, t
+
+def canonical(state):
+    """
+    Return (canonical state, t) where t is the transformation from state to the canonical state.
+    The canonical state's Zobrist key is the same in every process, so it can be stored on disk.
+    """
+    best = None
+    best_t = 0
+    for t in range(8):
+        table = PERMUTED[t]
+        candidate = (_permute(state.x, t), _permute(state.o, t), table[state.x_wins], table[state.o_wins],
+                     TRANSFORMS[t][state.last_cell] if state.last_cell != -1 else -1)
+        if best is None or candidate < best:
+            best = candidate
+            best_t = t
+    x, o, x_wins, o_wins, last_cell = best
+    return Bitboard(x, o, x_wins, o_wins, state.moveX, last_cell, state.winner), best_t
+
+def map_move(move, t):
+    """Apply transformation t to a move (board_num, cell)."""
+    perm = TRANSFORMS[t]
+    return perm[move[0]], perm[move[1]]
+
+def unmap_move(move, t):
+    """Undo transformation t on a move (board_num, cell)."""
+    return map_move(move, INVERSE[t])
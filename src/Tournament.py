@@ -0,0 +1,211 @@
+"""
+Self-play tournament between AI engines, to measure their speed and strength.
+
+Every pair of engines plays the given number of games, taking turns to be X.
+Each game starts from a few random moves, so that deterministic engines don't
+replay the same game. Games run in parallel processes.
+
+Engines are given on the command line as name:limit, for example
+    negamax:0.2     negamax with iterative deepening for 0.2 seconds a move
+    negamax:d5      negamax to depth 5
+    mcts:0.2        Monte Carlo Tree Search for 0.2 seconds a move
+    mcts:p2000      Monte Carlo Tree Search with 2000 playouts a move
+    random          random legal moves
+The search is run directly: the opening book and endgame solver are not used.
+
+For each engine it reports the nodes searched (playouts, for MCTS), nodes per
+second, and the mean and 99th percentile time per move, and for each pair the
+wins, draws and losses with a 95% confidence interval on the score.
+
+Example:
+    python Tournament.py negamax:0.1 mcts:0.1 --games 100 --workers 4
+"""
+
+import argparse
+import json
+import math
+import random
+import time
+import Ai
+import Mcts
+from Bitboard import Bitboard
+
+OPENING_PLIES = 2 # Random moves at the start of each game
+Z_95 = 1.96 # Standard normal quantile for a 95% confidence interval
+
+class Engine():
+    """A player in the tournament, parsed from a name:limit string."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        name, sep, limit = spec.partition(':')
+        if name not in ('negamax', 'mcts', 'random'):
+            raise ValueError('Unknown engine: %s' % spec)
+        self.name = name
+        self.time_budget = None
+        self.depth = None
+        self.playouts = None
+        if name == 'random':
+            return
+        if limit.startswith('d') and name == 'negamax':
+            self.depth = int(limit[1:])
+        elif limit.startswith('p') and name == 'mcts':
+            self.playouts = int(limit[1:])
+        else:
+            self.time_budget = float(limit or Ai.TIME_BUDGET)
+
+    def move(self, state, rand):
+        """Return (move, nodes searched) for the player to move in state."""
+        if self.name == 'random':
+            return rand.choice(state.legal_moves()), 0
+        if self.name == 'mcts':
+            return Mcts.best_move(state, self.time_budget, self.playouts, rand=rand)
+        stats = Ai.SearchStats()
+        if self.depth is not None:
+            result = Ai.iterativeDeepening(state, float('inf'), self.depth, stats=stats)
+        else:
+            result = Ai.iterativeDeepening(state, self.time_budget, stats=stats)
+        return result[1], stats.nodes
+
+def play_game(task):
+    """
+    Play one game. Runs in a worker process.
+
+    Arguments:
+        task: (spec of X, spec of O, random seed, number of random opening moves)
+
+    Return Value:
+        (winner, times, nodes) where winner is 'X', 'O' or None for a draw, and times and nodes
+        map 'X' and 'O' to lists of the time taken and nodes searched for each of their moves.
+    """
+    spec_x, spec_o, seed, opening_plies = task
+    rand = random.Random(seed)
+    engines = {'X': Engine(spec_x), 'O': Engine(spec_o)}
+    times = {'X': [], 'O': []}
+    nodes = {'X': [], 'O': []}
+    state = Bitboard()
+    for ply in range(opening_plies):
+        state.make(*rand.choice(state.legal_moves()))
+    while state.legal_moves():
+        player = 'X' if state.moveX else 'O'
+        started = time.time()
+        move, searched = engines[player].move(state, rand)
+        times[player].append(time.time() - started)
+        nodes[player].append(searched)
+        state.make(*move)
+    return state.winner, times, nodes
+
+def percentile(values, fraction):
+    """Return the value below which the given fraction of the values lie (nearest rank)."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, int(math.ceil(fraction*len(values))) - 1)]
+
+def score_interval(wins, draws, losses):
+    """Return (score, margin): the mean score (win 1, draw 1/2, loss 0) and its 95% confidence margin."""
+    games = wins + draws + losses
+    if not games:
+        return 0.0, 0.0
+    score = (wins + 0.5*draws)/games
+    variance = (wins*(1 - score)**2 + draws*(0.5 - score)**2 + losses*score**2)/games
+    return score, Z_95*math.sqrt(variance/games)
+
+def run(specs, games, workers=1, seed=0, opening_plies=OPENING_PLIES):
+    """
+    Play a round robin tournament.
+
+    Arguments:
+        specs: list of engine specs (see the module docstring)
+        games: games to play between each pair of engines
+        workers: processes to play games in
+        seed: random seed for the openings and the random engines
+        opening_plies: random moves at the start of each game
+
+    Return Value:
+        A report, as a dictionary:
+            engines: {spec: {moves, nodes, nps, mean_time, p99_time}}
+            matches: [{first, second, wins, draws, losses, score, margin}], from the first engine's view
+    """
+    for spec in specs:
+        Engine(spec) # Fail now on a bad spec, not in a worker
+    tasks = []
+    pairs = [(first, second) for i, first in enumerate(specs) for second in specs[i + 1:]]
+    for first, second in pairs:
+        for game in range(games):
+            game_seed = seed*1000003 + len(tasks)
+            if game % 2 == 0:
+                tasks.append((first, second, game_seed, opening_plies))
+            else:
+                tasks.append((second, first, game_seed, opening_plies))
+
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        results = pool.map(play_game, tasks)
+        pool.close()
+        pool.join()
+    else:
+        results = [play_game(task) for task in tasks]
+
+    times = dict((spec, []) for spec in specs)
+    nodes = dict((spec, 0) for spec in specs)
+    outcomes = dict((pair, [0, 0, 0]) for pair in pairs) # Wins, draws, losses for the first engine
+    for (spec_x, spec_o, game_seed, plies), (winner, game_times, game_nodes) in zip(tasks, results):
+        for player, spec in (('X', spec_x), ('O', spec_o)):
+            times[spec].extend(game_times[player])
+            nodes[spec] += sum(game_nodes[player])
+        pair = (spec_x, spec_o) if (spec_x, spec_o) in outcomes else (spec_o, spec_x)
+        if winner is None:
+            outcomes[pair][1] += 1
+        elif (winner == 'X') == (pair[0] == spec_x):
+            outcomes[pair][0] += 1
+        else:
+            outcomes[pair][2] += 1
+
+    report = {'engines': {}, 'matches': []}
+    for spec in specs:
+        total = sum(times[spec])
+        report['engines'][spec] = {'moves': len(times[spec]),
+                                   'nodes': nodes[spec],
+                                   'nps': nodes[spec]/total if total else 0.0,
+                                   'mean_time': total/len(times[spec]) if times[spec] else 0.0,
+                                   'p99_time': percentile(times[spec], 0.99)}
+    for first, second in pairs:
+        wins, draws, losses = outcomes[(first, second)]
+        score, margin = score_interval(wins, draws, losses)
+        report['matches'].append({'first': first, 'second': second, 'wins': wins, 'draws': draws,
+                                  'losses': losses, 'score': score, 'margin': margin})
+    return report
+
+def print_report(report):
+    print('%-14s %8s %12s %10s %10s %10s' % ('engine', 'moves', 'nodes', 'nodes/s', 'mean ms', 'p99 ms'))
+    for spec in sorted(report['engines']):
+        row = report['engines'][spec]
+        print('%-14s %8d %12d %10.0f %10.1f %10.1f' % (spec, row['moves'], row['nodes'], row['nps'],
+                                                       row['mean_time']*1000, row['p99_time']*1000))
+    print('')
+    for match in report['matches']:
+        print('%s vs %s: +%d =%d -%d, score %.3f +/- %.3f' % (match['first'], match['second'], match['wins'],
+                                                              match['draws'], match['losses'],
+                                                              match['score'], match['margin']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Play metaTicTacToe AI engines against each other.')
+    parser.add_argument('engines', nargs='+', help='engines to play, e.g. negamax:0.2 negamax:d4 mcts:p1000 random')
+    parser.add_argument('--games', type=int, default=20, help='games to play between each pair of engines')
+    parser.add_argument('--workers', type=int, default=1, help='processes to play games in')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--opening-plies', type=int, default=OPENING_PLIES, help='random moves at the start of each game')
+    parser.add_argument('--json', help='also write the report to this file as JSON')
+    args = parser.parse_args()
+    if len(args.engines) < 2:
+        parser.error('give at least two engines')
+    report = run(args.engines, args.games, args.workers, args.seed, args.opening_plies)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
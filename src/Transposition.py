@@ -0,0 +1,56 @@
+"""
+Transposition table for the AI search.
+
+The same metaTicTacToe position can be reached by many move orders. The table
+remembers the result of searching a position, keyed by its Zobrist hash
+(Bitboard.key), so that negamax can reuse it instead of searching again.
+"""
+
+# Bound types: what a stored value says about the true value of the position.
+EXACT = 0 # The value is exact
+LOWER = 1 # The search failed high: the true value is at least the stored value
+UPPER = 2 # The search failed low: the true value is at most the stored value
+
+class TranspositionTable(object):
+    """
+    A fixed-size hash table of search results.
+
+    Each slot holds a single entry (key, depth, value, bound, move, age).
+    When two positions map to the same slot, the new result replaces the old one
+    if the old one is from an earlier search (age) or was searched less deeply.
+    """
+
+    def __init__(self, size=1 << 16):
+        self.size = size
+        self.entries = [None]*size
+        self.age = 0
+
+    def new_search(self):
+        """Mark the start of a new search. Entries from earlier searches become replaceable."""
+        self.age += 1
+
+    def clear(self):
+        self.entries = [None]*self.size
+
+    def lookup(self, key):
+        """Return the entry (key, depth, value, bound, move, age) for a position, or None."""
+        entry = self.entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, value, bound, move):
+        """
+        Save a search result.
+
+        Arguments:
+            key: Zobrist hash of the position
+            depth: remaining depth the position was searched to
+            value: utility of the position for the player to move
+            bound: EXACT, LOWER or UPPER
+            move: best move found, as (board_num, cell)
+        """
+        index = key % self.size
+        old = self.entries[index]
+        if old is None or old[0] == key or old[5] != self.age or depth >= old[1]:
+            self.entries[index] = (key, depth, value, bound, move, self.age)
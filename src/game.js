@@ -20,6 +20,24 @@ $(document).ready(function() {
 			$(this).find(".cell").each( function(j) {
 				$(this).html(board[j]); // Put little Xs and Os in cells.
 			});
+		});
+		updateStatus();
+	};
+
+	// Update a single move on the metaboard
+	updateMove = function(move) {
+		var board = $(".board").eq(move.board_num);
+		board.find(".cell").eq(move.cell).html(move.piece);
+		if (move.mini_win) {
+			board.find(".mark").addClass(move.mini_win).html(move.mini_win);
+		}
+		updateStatus();
+	};
+
+	// Update which miniboards are playable and the game info
+	updateStatus = function() {
+		
+		$(".board").each( function(i) {
 			if (isLegalBoard(i) && isMyMove()) { 
 				$(this).children().addClass('playable'); // Highlight the miniboard(s) I can play in.
 			} else {
@@ -127,9 +145,66 @@ $(document).ready(function() {
 		sendMessage('/opened');
 	};
   
+	// Ask the server for the whole game state, after missing a message.
+	// If a newer message arrives meanwhile and the snapshot turns out older, ask again.
+	requestSnapshot = function() {
+		if (state.awaiting_snapshot) {
+			return;
+		}
+		state.awaiting_snapshot = true;
+		var xhr = new XMLHttpRequest();
+		xhr.open('POST', '/snapshot?g=' + state.game_id, true);
+		xhr.onload = function() {
+			state.awaiting_snapshot = false;
+			if (xhr.status == 200) {
+				onMessage({data: xhr.responseText});
+				if (state.seq < state.latest_seq) {
+					requestSnapshot();
+				}
+			}
+		};
+		xhr.onerror = function() {
+			state.awaiting_snapshot = false;
+		};
+		xhr.send();
+	};
+
+	// Messages are numbered (seq). A move is applied if it follows the last message applied,
+	// and older messages are ignored. If a move is missing, ask for the whole game state instead.
 	onMessage = function(m) {
 		data = m.data.replace(/&quot;/g, '"'); // Need to find a better solution
 		newState = JSON.parse(data);
+		if (state.latest_seq === undefined || newState.seq > state.latest_seq) {
+			state.latest_seq = newState.seq; // The newest message seen, applied or not
+		}
+		if (newState.type == 'move') {
+			if (newState.seq == state.seq + 1) {
+				applyMove(newState);
+			} else if (newState.seq > state.seq) {
+				requestSnapshot();
+			}
+		} else if (state.seq === undefined || newState.seq >= state.seq) {
+			applySnapshot(newState);
+		}
+	}
+
+	// Apply a move: only the cell played and what it changed
+	applyMove = function(move) {
+		var board = state.metaboard[move.board_num];
+		state.metaboard[move.board_num] = board.substr(0, move.cell) + move.piece + board.substr(move.cell + 1);
+		if (move.mini_win) {
+			state.all_mini_wins[move.board_num] = move.mini_win;
+		}
+		state.moveX = move.moveX;
+		state.last_cell = move.last_cell;
+		state.winner = move.winner || "";
+		state.seq = move.seq;
+		updateMove(move);
+	}
+
+	// Apply the whole game state
+	applySnapshot = function(newState) {
+		state.seq = newState.seq;
 		state.metaboard = newState.metaboard || state.metaboard;
 		state.all_mini_wins = newState.all_mini_wins || state.all_mini_wins;
 		state.userX = newState.userX || state.userX;
@@ -6,8 +6,19 @@ Created on Nov 1, 2013
 
 import unittest
 import logging
-from Models import User, Game
+import time
+import os
+import json
+from Models import User, Game, Move
 from Ai import *
+from Bitboard import Bitboard
+import AiWorker
+import Players
+import GameCache
+import Ponder
+from Main import GameUpdater
+from google.appengine.api import memcache
+from google.appengine.ext import db
 
 class Test(unittest.TestCase):
     def test_legal_moves(self):
@@ -31,4 +42,288 @@ class Test(unittest.TestCase):
                     all_mini_wins = [' ']*9,
                     metaboard = ['         ']*9)
         result = negamax(myGame, 7, float('-inf'), float('inf'))
-        self.assertEqual(result, (0, (4, 0)))
\ No newline at end of file
+        self.assertEqual(result, (0, (4, 0)))
+
+    def test_iterative_deepening(self):
+        userX = User()
+        userX.put()
+        myGame = Game(userX = userX,
+                    moveX = True,
+                    last_cell = 2,
+                    all_mini_wins = ['X', 'X', ' ', ' ', ' ', ' ', ' ', ' ', ' '],
+                    metaboard = ['XXXOO    ', 'XXXOO    ', 'XX O O   '] + ['         ']*6)
+        self.assertEqual(nextMove(myGame, time_budget=0.1), (2, 2))
+
+    def test_ai_time_budget(self):
+        self.assertEqual(AiWorker.time_budget(1), TIME_BUDGET)
+        self.assertEqual(AiWorker.time_budget(AiWorker.CAPACITY), TIME_BUDGET)
+        self.assertTrue(AiWorker.time_budget(AiWorker.CAPACITY*2) < TIME_BUDGET)
+        self.assertEqual(AiWorker.time_budget(10**6), AiWorker.MIN_BUDGET)
+
+    def test_ai_players(self):
+        ai = User(key=db.Key.from_path('User', Players.ai_user_id()))
+        ai.put()
+        Players._ai_user = None
+        userX = User()
+        userX.put()
+        myGame = Game(userX = userX,
+                    moveX = True,
+                    last_cell = -1,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['         ']*9)
+        self.assertFalse(Players.is_ai(myGame))
+        self.assertTrue(Players.assign(myGame, 'quick'))
+        self.assertTrue(Players.is_ai(myGame))
+        self.assertEqual(myGame.userO, ai)
+        self.assertEqual((myGame.ai_engine, myGame.ai_time_budget), ('negamax', 0.05))
+        myGame.is_ai = False # A game from before is_ai was stored
+        self.assertTrue(Players.is_ai(myGame))
+
+    def test_game_cache(self):
+        GameCache.set_cache(GameCache.LocalCache())
+        userX = User()
+        userX.put()
+        myGame = Game(userX = userX,
+                    moveX = True,
+                    last_cell = -1,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['         ']*9)
+        GameCache.put(myGame)
+        game_id = myGame.key().id()
+        stale = GameCache.get(game_id)
+        self.assertEqual(stale.version, 1)
+        myGame.move(4, 4, userX)
+        GameCache.put(myGame)
+        GameCache._store(stale) # An older version never replaces a newer one
+        cached = GameCache.get(game_id)
+        self.assertEqual((cached.version, cached.metaboard[4]), (2, '    X    '))
+        myGame.delete()
+        self.assertEqual(GameCache.get(game_id).version, 2) # Served from the cache
+        GameCache.invalidate(game_id)
+        self.assertEqual(GameCache.get(game_id), None)
+        GameCache.set_cache(GameCache.memcache.Client())
+
+    def test_game_update_conflict(self):
+        GameCache.set_cache(GameCache.LocalCache())
+        userX = User()
+        userX.put()
+        userO = User()
+        userO.put()
+        myGame = Game(userX = userX,
+                    userO = userO,
+                    moveX = True,
+                    last_cell = -1,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['         ']*9)
+        GameCache.put(myGame)
+        first = Game.load(myGame.key().id())
+        second = Game.load(myGame.key().id()) # Loaded before the first move is saved, as by a double click
+        conflicts = GameCache.get_stats()['conflicts']
+        self.assertTrue(GameCache.update(first, lambda game: game.move(4, 4, userX)))
+        self.assertEqual(GameCache.update(second, lambda game: game.move(4, 0, userX)), None)
+        self.assertEqual(GameCache.get_stats()['conflicts'], conflicts + 1)
+        stored = Game.load(myGame.key().id())
+        self.assertEqual((stored.version, stored.metaboard[4], stored.moveX), (2, '    X    ', False))
+        GameCache.set_cache(GameCache.memcache.Client())
+
+    def test_move_log(self):
+        userX = User()
+        userX.put()
+        userO = User()
+        userO.put()
+        myGame = Game(userX = userX,
+                    userO = userO,
+                    moveX = True,
+                    last_cell = -1,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['         ']*9)
+        myGame.put()
+        moves = [(4, 0), (0, 4), (4, 1), (1, 4), (4, 2), (2, 4), (4, 3), (3, 4), (4, 5), (5, 4), (4, 6), (6, 4)]
+        states = []
+        for board_num, cell in moves:
+            myGame.move(board_num, cell, userX if myGame.moveX else userO)
+            myGame.put()
+            states.append(myGame.metaboard)
+        self.assertEqual(len(Move.all().ancestor(myGame).fetch(100)), 12)
+        loaded = Game.load(myGame.key().id())
+        self.assertEqual((loaded.snapshot_move, loaded.move_count), (10, 12))
+        self.assertEqual((loaded.metaboard, loaded.last_cell, loaded.moveX), (states[-1], 4, True))
+        self.assertEqual(loaded.state_at(0).metaboard, ['         ']*9)
+        self.assertEqual(loaded.state_at(5).metaboard, states[4])
+        self.assertEqual(loaded.state_at(11).metaboard, states[10])
+        self.assertEqual(loaded.state_at(13), None)
+
+    def test_move_log_round_trip(self):
+        userX = User()
+        userX.put()
+        userO = User()
+        userO.put()
+        myGame = Game(userX = userX,
+                    userO = userO,
+                    moveX = True,
+                    last_cell = -1,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['         ']*9)
+        myGame.put()
+        moves = [(4, 0), (0, 4), (4, 1), (1, 4), (4, 2), (2, 4), (4, 3), (3, 4), (4, 5), (5, 4), (4, 6), (6, 4)]
+        for board_num, cell in moves:
+            myGame.move(board_num, cell, userX if myGame.moveX else userO)
+            myGame.put()
+        # The entity as stored holds the snapshot after 10 moves, under the board's own names
+        stored = Game.get_by_id(myGame.key().id())
+        self.assertEqual((stored.snapshot_move, stored.snapshot_metaboard[4], stored.snapshot_last_cell), (10, 'XXXX X   ', 4))
+        self.assertEqual((stored.metaboard, stored.last_cell), (stored.snapshot_metaboard, 4))
+        # Saving it again between snapshots keeps the snapshot
+        loaded = Game.load(myGame.key().id())
+        loaded.move(4, 4, userX)
+        loaded.put()
+        reloaded = Game.load(myGame.key().id())
+        self.assertEqual((reloaded.move_count, reloaded.metaboard[4], reloaded.state_at(11).metaboard[5]),
+                         (13, 'XXXXXXX  ', '    O    '))
+        cached = GameCache.deserialize(GameCache.serialize(reloaded))
+        self.assertEqual((cached.snapshot_move, cached.metaboard, cached.moveX), (10, reloaded.metaboard, False))
+
+    def test_move_message(self):
+        userX = User()
+        userX.put()
+        userO = User()
+        userO.put()
+        myGame = Game(userX = userX,
+                    userO = userO,
+                    moveX = True,
+                    last_cell = -1,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['         ']*9)
+        GameCache.put(myGame)
+        for board_num, cell in [(4, 0), (0, 4), (4, 1), (1, 4), (4, 2)]:
+            myGame.move(board_num, cell, userX if myGame.moveX else userO)
+            GameCache.put(myGame)
+        move = json.loads(GameUpdater(myGame).get_move_message(4, 2))
+        self.assertEqual(move, {'type': 'move', 'seq': 6, 'board_num': 4, 'cell': 2, 'piece': 'X',
+                                'last_cell': 2, 'moveX': False, 'mini_win': 'X'})
+        snapshot = json.loads(GameUpdater(myGame).get_game_message())
+        self.assertEqual((snapshot['type'], snapshot['seq'], snapshot['metaboard'][4]), ('snapshot', 6, 'XXX      '))
+        # The miniboard was won by an earlier move: the next move in it doesn't send it again
+        for board_num, cell in [(2, 4), (4, 3)]:
+            myGame.move(board_num, cell, userX if myGame.moveX else userO)
+            GameCache.put(myGame)
+        move = json.loads(GameUpdater(myGame).get_move_message(4, 3))
+        self.assertEqual((move['seq'], move['piece'], 'mini_win' in move), (8, 'X', False))
+
+    def test_ponder(self):
+        GameCache.set_cache(GameCache.LocalCache())
+        AiWorker.set_queue(AiWorker.LocalQueue())
+        User(key=db.Key.from_path('User', Players.ai_user_id())).put()
+        Players._ai_user = None
+        userX = User()
+        userX.put()
+        myGame = Game(userX = userX,
+                    moveX = True,
+                    last_cell = 4,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['         ']*9)
+        Players.assign(myGame, 'quick')
+        GameCache.put(myGame)
+        game_id = myGame.key().id()
+        # Each answer gets no longer than the persona's own time budget
+        started = time.time()
+        Ponder.ponder(myGame, time_budget=2.0)
+        self.assertTrue(time.time() - started < 1.5)
+        answers = memcache.get('ponder:%s' % game_id)
+        self.assertEqual(len(answers), 9)
+        state = Bitboard.from_game(myGame)
+        for reply in state.legal_moves():
+            undo = state.make(*reply)
+            self.assertTrue(answers[state.key] in state.legal_moves())
+            state.unmake(undo)
+        # Prepared answers are only played in their own position, and only if legal
+        myGame.move(4, 4, userX)
+        self.assertEqual(Ponder.lookup(myGame), answers[Bitboard.from_game(myGame).key])
+        memcache.set('ponder:%s' % game_id, {Bitboard.from_game(myGame).key: (4, 4)})
+        self.assertEqual(Ponder.lookup(myGame), None) # Illegal: the human's piece is there
+        memcache.set('ponder:%s' % game_id, {Bitboard.from_game(myGame).key ^ 1: (4, 0)})
+        self.assertEqual(Ponder.lookup(myGame), None) # Stale: prepared for another position
+        # The human's move is answered with the prepared move straight away, without queueing a search
+        myGame = GameCache.get(game_id)
+        state = Bitboard.from_game(myGame)
+        state.make(4, 4)
+        memcache.set('ponder:%s' % game_id, {state.key: (4, 8)})
+        pending = AiWorker.get_pending()
+        GameUpdater(myGame).make_move(4, 4, userX)
+        stored = GameCache.get(game_id)
+        self.assertEqual((stored.metaboard[4], stored.moveX, stored.last_cell), ('    X   O', True, 8))
+        self.assertEqual(AiWorker.get_pending(), pending)
+        AiWorker._queue.join() # Pondering the human's next reply
+        AiWorker.set_queue(AiWorker.TaskQueue())
+        GameCache.set_cache(GameCache.memcache.Client())
+
+    def test_ai_worker(self):
+        GameCache.set_cache(GameCache.LocalCache())
+        AiWorker.set_queue(AiWorker.LocalQueue())
+        User(key=db.Key.from_path('User', Players.ai_user_id())).put()
+        Players._ai_user = None
+        userX = User()
+        userX.put()
+        myGame = Game(userX = userX,
+                    moveX = True,
+                    last_cell = -1,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['         ']*9)
+        Players.assign(myGame, 'quick')
+        myGame.move(4, 4, userX)
+        GameCache.put(myGame)
+        game_id = myGame.key().id()
+        pending = AiWorker.get_pending()
+        AiWorker.schedule_ai_move(myGame)
+        AiWorker._queue.join()
+        stored = Game.load(game_id)
+        self.assertEqual((stored.move_count, stored.moveX, stored.version), (2, True, 2))
+        self.assertEqual(stored.metaboard[4].count('O'), 1)
+        self.assertEqual(AiWorker.get_pending(), pending)
+        # Not the AI's turn, e.g. the task ran twice: nothing happens
+        AiWorker.play_ai_move(game_id)
+        self.assertEqual(GameCache.get(game_id).version, 2)
+        AiWorker.set_queue(AiWorker.TaskQueue())
+        GameCache.set_cache(GameCache.memcache.Client())
+
+    def test_ai_after_draw(self):
+        GameCache.set_cache(GameCache.LocalCache())
+        AiWorker.set_queue(AiWorker.LocalQueue())
+        User(key=db.Key.from_path('User', Players.ai_user_id())).put()
+        Players._ai_user = None
+        userX = User()
+        userX.put()
+        myGame = Game(userX = userX,
+                    moveX = True,
+                    last_cell = 8,
+                    all_mini_wins = [' ']*9,
+                    metaboard = ['XOXXOOOXX']*8 + ['XOXXOOOX '])
+        Players.assign(myGame, 'quick')
+        GameCache.put(myGame)
+        game_id = myGame.key().id()
+        pending = AiWorker.get_pending()
+        GameUpdater(myGame).make_move(8, 8, userX) # Fills the last cell: a draw
+        self.assertEqual(AiWorker.get_pending(), pending) # No AI move was queued
+        stored = GameCache.get(game_id)
+        self.assertEqual((stored.metaboard[8], stored.moveX, stored.winner), ('XOXXOOOXX', False, None))
+        GameUpdater(stored).make_ai_move() # Nothing to search
+        self.assertEqual(GameCache.get(game_id).version, stored.version)
+        AiWorker.set_queue(AiWorker.TaskQueue())
+        GameCache.set_cache(GameCache.memcache.Client())
+
+    def test_ai_move_retries(self):
+        memcache.incr(AiWorker.PENDING, initial_value=0) # As schedule_ai_move does
+        pending = AiWorker.get_pending()
+        moves = memcache.get(AiWorker.MOVES) or 0
+        try:
+            # A task that fails is retried: the move stays pending, and is only counted once
+            for retries in range(AiWorker.AI_RETRY_LIMIT):
+                os.environ['HTTP_X_APPENGINE_TASKRETRYCOUNT'] = str(retries)
+                self.assertRaises(Exception, AiWorker.play_ai_move, 'not a game id')
+                self.assertEqual((AiWorker.get_pending(), memcache.get(AiWorker.MOVES)), (pending, moves + 1))
+            # The last attempt gives up
+            os.environ['HTTP_X_APPENGINE_TASKRETRYCOUNT'] = str(AiWorker.AI_RETRY_LIMIT)
+            self.assertRaises(Exception, AiWorker.play_ai_move, 'not a game id')
+            self.assertEqual((AiWorker.get_pending(), memcache.get(AiWorker.MOVES)), (pending - 1, moves + 1))
+        finally:
+            del os.environ['HTTP_X_APPENGINE_TASKRETRYCOUNT']
\ No newline at end of file
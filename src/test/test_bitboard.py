@@ -0,0 +1,125 @@
+'''
+Tests for the bitboard game state used by the AI.
+'''
+
+import random
+import re
+import unittest
+from Bitboard import Bitboard
+from GameState import GameState
+
+def string_win_chances(board, player):
+    """The original regex implementation of Ai.winChances, kept as a reference."""
+    board = ''.join(board)
+    patterns = [' XX......', 'X X......', 'XX ......', '... XX...', '...X X...', '...XX ...',
+                '...... XX', '......X X', '......XX ', ' ..X..X..', 'X.. ..X..', 'X..X.. ..',
+                '. ..X..X.', '.X.. ..X.', '.X..X.. .', '.. ..X..X', '..X.. ..X', '..X..X.. ',
+                ' ...X...X', 'X... ...X', 'X...X... ', '.. .X.X..', '..X. .X..', '..X.X. ..']
+    return sum(1 for pattern in patterns if re.match(pattern.replace('X', player), board))
+
+def string_utility(state):
+    """The original string implementation of Ai.getUtility, kept as a reference."""
+    if state.winner:
+        return -1000
+    metaboard, all_mini_wins = state.metaboard, state.all_mini_wins
+    mini_win_chances = 0
+    for i in range(9):
+        if all_mini_wins[i] == ' ':
+            mini_win_chances += string_win_chances(metaboard[i], 'X') - string_win_chances(metaboard[i], 'O')
+    mini_wins = all_mini_wins.count('X') - all_mini_wins.count('O')
+    meta_win_chances = string_win_chances(all_mini_wins, 'X') - string_win_chances(all_mini_wins, 'O')
+    return (mini_win_chances + mini_wins*10 + meta_win_chances*15)*(1 if state.moveX else -1)
+
+class Test(unittest.TestCase):
+    def test_legal_moves(self):
+        state = Bitboard(last_cell=1)
+        self.assertEqual(state.legal_moves(), [(1, 0), (1, 1), (1, 2), (1, 3), (1, 4), (1, 5), (1, 6), (1, 7), (1, 8)])
+        self.assertEqual(len(Bitboard().legal_moves()), 81)
+
+    def test_strings_round_trip(self):
+        metaboard = ['XXX O    ', 'O        ', ' X       ', '         ', '    O    ',
+                     '         ', '        X', '         ', 'OOO      ']
+        all_mini_wins = ['X', ' ', ' ', ' ', ' ', ' ', ' ', ' ', 'O']
+        state = Bitboard.from_strings(metaboard, all_mini_wins, True, 4)
+        self.assertEqual(state.metaboard, metaboard)
+        self.assertEqual(state.all_mini_wins, all_mini_wins)
+        self.assertEqual(state.legal_moves(), [(4, c) for c in (0, 1, 2, 3, 5, 6, 7, 8)])
+
+    def test_mini_and_meta_win(self):
+        state = Bitboard.from_strings(['XX       ', '         ', '         ',
+                                       '         ', 'XXX      ', '         ',
+                                       '         ', '         ', 'XXX      '],
+                                      [' ', ' ', ' ', ' ', 'X', ' ', ' ', ' ', 'X'], True, 0)
+        before = state.copy()
+        undo = state.make(0, 2)
+        self.assertEqual(state.all_mini_wins[0], 'X')
+        self.assertEqual(state.winner, 'X')
+        self.assertEqual(state.legal_moves(), [])
+        state.unmake(undo)
+        self.assertEqual(state, before)
+
+    def test_mini_win_owner_in_key(self):
+        # The same pieces, with miniboard 0 won by X or by O (play goes on in won miniboards)
+        metaboard = ['XXXOOO   '] + ['X        ', 'O        ']*4
+        x_owns = Bitboard.from_strings(metaboard, ['X'] + [' ']*8, True, 3)
+        o_owns = Bitboard.from_strings(metaboard, ['O'] + [' ']*8, True, 3)
+        self.assertNotEqual(x_owns.key, o_owns.key)
+        self.assertNotEqual(x_owns.key, Bitboard.from_strings(metaboard, [' ']*9, True, 3).key)
+        # make updates the key of a won miniboard as compute_key does
+        state = Bitboard.from_strings(['XX       '] + ['         ']*8, [' ']*9, True, 0)
+        state.make(0, 2)
+        self.assertEqual(state.all_mini_wins[0], 'X')
+        self.assertEqual(state.key, state.compute_key())
+
+    def test_full_board_frees_next_move(self):
+        state = Bitboard.from_strings(['         ', 'XOXOXOOXO', '         ', '         ', '         ',
+                                       '         ', '         ', '         ', '         '],
+                                      [' ']*9, True, 0)
+        state.make(0, 1)
+        self.assertEqual(state.last_cell, -1)
+
+    def test_make_unmake_random_games(self):
+        rand = random.Random(42)
+        for game in range(20):
+            state = Bitboard()
+            history = []
+            while state.legal_moves():
+                before = state.copy()
+                history.append((before, state.make(*rand.choice(state.legal_moves()))))
+                # Every state must survive a round trip through the string representation.
+                rebuilt = Bitboard.from_strings(state.metaboard, state.all_mini_wins,
+                                                state.moveX, state.last_cell, state.winner)
+                self.assertEqual(rebuilt, state)
+                self.assertEqual(rebuilt.key, state.key)
+                self.assertEqual(rebuilt.score, state.score)
+            while history:
+                before, undo = history.pop()
+                state.unmake(undo)
+                self.assertEqual(state, before)
+                self.assertEqual(state.key, before.key)
+                self.assertEqual(state.score, before.score)
+
+    def test_utility_matches_string_evaluation(self):
+        rand = random.Random(7)
+        for game in range(20):
+            state = Bitboard()
+            while state.legal_moves():
+                self.assertEqual(state.utility(), string_utility(state))
+                state.make(*rand.choice(state.legal_moves()))
+            self.assertEqual(state.utility(), string_utility(state))
+
+    def test_game_state_matches_bitboard(self):
+        rand = random.Random(7)
+        for game in range(50):
+            state = GameState()
+            bitboard = Bitboard()
+            while bitboard.legal_moves():
+                legal = bitboard.legal_moves()
+                self.assertEqual(state.legal_moves(), legal)
+                self.assertEqual([(b, c) for b in range(9) for c in range(9) if state.is_legal_move(b, c)], legal)
+                move = rand.choice(legal)
+                self.assertTrue(state.move(*move))
+                self.assertFalse(state.move(*move)) # Now occupied
+                bitboard.make(*move)
+                self.assertEqual(Bitboard.from_game(state), bitboard)
+            self.assertEqual(state.winner, bitboard.winner)
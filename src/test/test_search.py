@@ -0,0 +1,175 @@
+'''
+Tests for the pieces of the AI search that don't need the datastore.
+'''
+
+import os
+import random
+import tempfile
+import time
+import unittest
+from Bitboard import Bitboard
+import Ai
+import Batch
+import Benchmark
+import OpeningBook
+import Endgame
+import Mcts
+import Parallel
+import Symmetry
+import Tournament
+from Ordering import MoveOrderer
+from Transposition import TranspositionTable, EXACT, LOWER
+
+class Test(unittest.TestCase):
+    def test_table_replacement(self):
+        table = TranspositionTable(size=8)
+        table.store(3, 4, 10, EXACT, (0, 0))
+        table.store(11, 2, 20, LOWER, (1, 1)) # Same slot, shallower: keep the deeper entry
+        self.assertEqual(table.lookup(3)[2], 10)
+        self.assertEqual(table.lookup(11), None)
+        table.new_search()
+        table.store(11, 2, 20, LOWER, (1, 1)) # Same slot, older entry: replace
+        self.assertEqual(table.lookup(11)[2], 20)
+        self.assertEqual(table.lookup(3), None)
+
+    def test_ordering(self):
+        # X to move in board 0: (0, 2) wins the miniboard, (0, 5) blocks O, (0, 8) sends O to a full board.
+        state = Bitboard.from_strings(['XX OO    ', '         ', '         ', '         ', '         ',
+                                       '         ', '         ', '         ', 'XOXOXOOXO'],
+                                      [' ']*9, True, 0)
+        orderer = MoveOrderer()
+        orderer.cutoff((0, 7), 3, 0)
+        moves = state.legal_moves()
+        orderer.order(state, moves, (0, 6), 0)
+        self.assertEqual(moves, [(0, 6), (0, 2), (0, 5), (0, 7), (0, 8)])
+
+    def test_opening_book_round_trip(self):
+        self.assertEqual(len(list(OpeningBook.positions(1))), 16) # The start, and 15 first moves up to symmetry
+        book = dict((state.key, state.legal_moves()[-1]) for state in OpeningBook.positions(1))
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            OpeningBook.save(book, path)
+            self.assertEqual(OpeningBook.load(path), book)
+        finally:
+            os.remove(path)
+
+    def test_symmetry(self):
+        state = Bitboard(last_cell=-1)
+        state.make(0, 1)
+        state.make(1, 5)
+        for t in range(8):
+            other = Symmetry.transform(state, t)
+            self.assertEqual(Symmetry.canonical(other)[0], Symmetry.canonical(state)[0])
+            self.assertEqual(Symmetry.canonical_key(other)[0], Symmetry.canonical_key(state)[0])
+            self.assertEqual(other.utility(), state.utility())
+            self.assertEqual(sorted(Symmetry.map_move(move, t) for move in state.legal_moves()),
+                             sorted(other.legal_moves()))
+            self.assertEqual(Symmetry.unmap_move(Symmetry.map_move((2, 7), t), t), (2, 7))
+        # Positions that aren't symmetric have different keys: the same piece 64 squares apart,
+        # or the same pieces with a miniboard won by the other player.
+        apart = Bitboard.from_strings(['X        '] + ['         ']*8, [' ']*9, False, 0)
+        moved = Bitboard(x=1 << 64, moveX=False, last_cell=0)
+        self.assertNotEqual(Symmetry.canonical_key(apart)[0], Symmetry.canonical_key(moved)[0])
+        metaboard = ['XXXOOO   '] + ['X        ', 'O        ']*4
+        x_owns = Bitboard.from_strings(metaboard, ['X'] + [' ']*8, True, 3)
+        o_owns = Bitboard.from_strings(metaboard, ['O'] + [' ']*8, True, 3)
+        self.assertNotEqual(Symmetry.canonical_key(x_owns)[0], Symmetry.canonical_key(o_owns)[0])
+
+    def test_parallel_search(self):
+        state = Bitboard(last_cell=4)
+        state.make(4, 0)
+        expected = Ai.negamax(state, 3, float('-inf'), float('inf'))[0]
+        for workers in (1, 2):
+            value, move, path = Parallel.parallel_search(state, None, workers, max_depth=3, deterministic=True)
+            self.assertEqual(value, expected)
+        value, move, path = Parallel.parallel_search(state, 0.2, 2)
+        self.assertTrue(move in state.legal_moves())
+
+    def test_parallel_search_budget_without_pool(self):
+        state = Bitboard(last_cell=4)
+        state.make(4, 0)
+        available = Parallel.multiprocessing
+        Parallel.multiprocessing = None # As on App Engine: the moves are searched one after another
+        try:
+            started = time.time()
+            value, move, path = Parallel.parallel_search(state, 0.2, 4)
+            elapsed = time.time() - started
+        finally:
+            Parallel.multiprocessing = available
+        self.assertTrue(move in state.legal_moves())
+        self.assertTrue(elapsed < 0.4) # The whole budget, not a share of it for each of 4 workers
+
+    def test_endgame(self):
+        # X to move in board 2 wins the game with (2, 2).
+        state = Bitboard.from_strings(['XXXOO    ', 'XXXOO    ', 'XX O O   '] + ['         ']*6,
+                                      ['X', 'X', ' ', ' ', ' ', ' ', ' ', ' ', ' '], True, 2)
+        self.assertEqual(Endgame.solve(state), (Endgame.WIN - 1, (2, 2)))
+        self.assertEqual(Endgame.describe(Endgame.WIN - 1), ('win', 1))
+        # Nobody can win the last two cells.
+        state = Bitboard.from_strings(['XOXXOOOXX'] + ['XOXXOOOX '] + ['XOXXOOOXX']*6 + ['XOXXOOOX '],
+                                      [' ']*9, True, 1)
+        self.assertEqual(Endgame.solve(state), (0, (1, 8)))
+        # The game is over: a full board with no wins
+        state = Bitboard.from_strings(['XOXXOOOXX']*9, [' ']*9, True, -1)
+        self.assertEqual(Endgame.solve(state), (0, (-1,-1)))
+        self.assertEqual(Ai.chooseMove(state, 0.1), (-1,-1))
+
+    def test_mcts(self):
+        state = Bitboard.from_strings(['XXXOO    ', 'XXXOO    ', 'XX O O   '] + ['         ']*6,
+                                      ['X', 'X', ' ', ' ', ' ', ' ', ' ', ' ', ' '], True, 2)
+        move, visits = Mcts.best_move(state, playouts=500, tree_id='test', rand=random.Random(1))
+        self.assertEqual(move, (2, 2))
+        self.assertEqual(visits, 500)
+        # The tree is reused after a move has been played.
+        state.make(2, 4)
+        move, visits = Mcts.best_move(state, playouts=100, tree_id='test', rand=random.Random(1))
+        self.assertTrue(visits > 100)
+
+    @unittest.skipIf(Batch.numpy is None, 'NumPy is not installed')
+    def test_batch_evaluate(self):
+        rand = random.Random(3)
+        states = []
+        for game in range(20):
+            state = Bitboard()
+            while state.legal_moves():
+                states.append(state.copy())
+                state.make(*rand.choice(state.legal_moves()))
+            states.append(state)
+        scores, legal, winners = Batch.evaluate(*Batch.from_states(states))
+        for i, state in enumerate(states):
+            self.assertEqual(scores[i], state.utility())
+            self.assertEqual([(square // 9, square % 9) for square in legal[i].nonzero()[0]], state.legal_moves())
+            self.assertEqual(winners[i], {'X': 1, 'O': -1, None: 0}[state.winner])
+
+    def test_tournament(self):
+        report = Tournament.run(['negamax:d2', 'random'], 4)
+        match = report['matches'][0]
+        self.assertEqual(match['wins'] + match['draws'] + match['losses'], 4)
+        self.assertTrue(report['engines']['negamax:d2']['nodes'] > 0)
+        score, margin = Tournament.score_interval(1, 2, 1)
+        self.assertEqual(score, 0.5)
+        self.assertAlmostEqual(margin, 1.96*(0.125/4)**0.5)
+        self.assertEqual(Tournament.percentile(list(range(1, 101)), 0.99), 99)
+
+    def test_search_stats(self):
+        state = Bitboard(last_cell=4)
+        state.make(4, 0)
+        stats = Ai.SearchStats()
+        Ai.iterativeDeepening(state, float('inf'), 4, stats=stats)
+        self.assertEqual(stats.depth, 4)
+        self.assertEqual([depth for depth, nodes, seconds in stats.iterations], [1, 2, 3, 4])
+        self.assertEqual(stats.nodes, sum(nodes for depth, nodes, seconds in stats.iterations))
+        self.assertTrue(0 < stats.leaves < stats.nodes)
+        self.assertTrue(0 < stats.first_move_cutoffs <= stats.cutoffs)
+        self.assertTrue(stats.branching_factor() > 1)
+
+    def test_benchmark_corpus_and_compare(self):
+        positions = Benchmark.corpus(30, 5)
+        self.assertEqual([state.key for state in positions], [state.key for state in Benchmark.corpus(30, 5)])
+        self.assertTrue(all(bin(state.x | state.o).count('1') == 30 and state.legal_moves() for state in positions))
+        baseline = {'results': {'a': {'early': 1.0}, 'b': {'early': 1.0}}}
+        report = {'results': {'a': {'early': 1.1}, 'b': {'early': 1.5}, 'c': {'early': 9.0}}}
+        rows, regressions = Benchmark.compare(report, baseline)
+        self.assertEqual([row[0] for row in rows], ['b', 'a'])
+        self.assertEqual([row[0] for row in regressions], ['b'])
\ No newline at end of file